@@ -0,0 +1,163 @@
+# backfill.py
+import asyncio
+import time
+from .log import get_logger
+from .snapshot import dump_in_background, dump_json, encode_json, load_json
+
+logger = get_logger("backfill", "Backfill")
+
+# 新记录多少次水位后保存一次
+_SAVE_EVERY = 50
+
+
+def message_key(group_id, message_id) -> str:
+    """源消息在去重存储 message 命名空间中的键"""
+    return f"{group_id}:{message_id}"
+
+
+class Backfiller:
+    """补漏 - 按群记录已处理消息的水位，重启后通过 get_group_msg_history 取回停机期间的消息
+
+    水位为已处理的最新消息时间，以及该秒内已处理的消息 ID（同一秒可能有多条消息）。
+    没有水位的群不补漏，只从第一条实时消息开始记录，避免首次启动时搬运整段历史。
+    实时消息会推进水位，补漏使用上次补漏（或启动时）的水位，停机期间的消息不会被实时消息跳过。
+    """
+
+    def __init__(self, state_path: str, store, page_size: int = 20, max_messages: int = 200,
+                 rate: float = 1.0):
+        self.state_path = state_path
+        self.store = store
+        self.page_size = max(1, page_size)
+        self.max_messages = max(0, max_messages)
+        # 每秒最多送入流水线的消息条数
+        self.rate = rate
+        self._marks = {}  # group_id -> {"time": 秒, "ids": [该秒内已处理的消息 ID]}
+        self._start_marks = {}  # 补漏起点，启动时为磁盘上的水位，每次补漏后推进到当前水位
+        self._pending = 0
+        self.running = False
+
+    def load(self):
+        """加载水位（同步，应在线程中调用），与加载期间已记录的实时水位合并"""
+        try:
+            saved = load_json(self.state_path, {})
+        except Exception as e:
+            logger.error("加载补漏水位失败: %s", e)
+            return
+        for group_id, mark in saved.items():
+            self._start_marks[group_id] = {"time": mark["time"], "ids": list(mark["ids"])}
+            current = self._marks.get(group_id)
+            if current is None or mark["time"] > current["time"]:
+                self._marks[group_id] = mark
+
+    def save(self):
+        try:
+            dump_json(self.state_path, dict(self._marks))
+            self._pending = 0
+        except Exception as e:
+            logger.error("保存补漏水位失败: %s", e)
+
+    def groups(self):
+        """有水位的群"""
+        return list(dict.fromkeys([*self._start_marks, *self._marks]))
+
+    def observe(self, group_id, message_id, ts):
+        """记录一条已处理的消息，水位只前进不后退"""
+        group_id, message_id, ts = str(group_id), str(message_id), int(ts or time.time())
+        mark = self._marks.get(group_id)
+        if mark is None or ts > mark["time"]:
+            self._marks[group_id] = {"time": ts, "ids": [message_id]}
+        elif ts == mark["time"] and message_id not in mark["ids"]:
+            mark["ids"].append(message_id)
+        else:
+            return
+        self._pending += 1
+        if self._pending >= _SAVE_EVERY:
+            self._pending = 0
+            # 在事件循环中编码，避免线程中序列化时水位的 ID 列表仍在被修改
+            dump_in_background(self.state_path, encode_json(self._marks))
+
+    def _is_new(self, mark, message) -> bool:
+        ts = int(message.get("time", 0))
+        return ts > mark["time"] or (ts == mark["time"] and str(message.get("message_id")) not in mark["ids"])
+
+    async def fetch_new(self, call_action, group_id) -> list:
+        """从最新消息往前翻页，取回水位之后的消息，按时间升序返回"""
+        mark = self._start_marks.get(str(group_id)) or self._marks.get(str(group_id))
+        if mark is None or self.max_messages == 0:
+            return []
+        collected = {}
+        anchor = 0
+        # 翻到水位或最早的消息为止；达到条数上限提前结束时，水位之前可能还有未取回的消息
+        complete = False
+        while len(collected) < self.max_messages:
+            params = {"group_id": int(group_id), "count": self.page_size}
+            if anchor:
+                params["message_seq"] = anchor
+            response = await call_action("get_group_msg_history", **params)
+            messages = (response or {}).get("messages") or []
+            fresh = [m for m in messages if self._is_new(mark, m)]
+            for message in fresh:
+                collected.setdefault(str(message.get("message_id")), message)
+            # 这一页已经翻到水位之前，或没有更早的消息
+            if len(fresh) < len(messages) or not messages:
+                complete = True
+                break
+            oldest = min(messages, key=lambda m: int(m.get("time", 0)))
+            next_anchor = oldest.get("message_seq") or oldest.get("message_id")
+            if not next_anchor or next_anchor == anchor:
+                complete = True
+                break
+            anchor = next_anchor
+        result = sorted(collected.values(), key=lambda m: (int(m.get("time", 0)), str(m.get("message_id"))))
+        dropped = max(0, len(result) - self.max_messages)
+        if dropped or not complete:
+            # 补漏后水位会越过这些消息，之后不会再取回
+            logger.warning(
+                "群 %s 待补消息达到 %s 条上限，只补最新的 %s 条，舍弃 %s 条%s",
+                group_id, self.max_messages, min(len(result), self.max_messages), dropped,
+                "" if complete else "，更早的消息未翻页取回",
+            )
+        return result[-self.max_messages:]
+
+    async def run(self, call_action, groups, handler):
+        """补漏所有群，handler(group_id, message) 把消息送入正常的转发流水线
+
+        取回的消息先按消息 ID 批量查去重存储，实时流程已处理过的直接跳过；
+        其余按 rate 限速逐条处理。返回送入流水线的消息条数。
+        """
+        if self.running:
+            return 0
+        self.running = True
+        fed = 0
+        try:
+            for group_id in groups:
+                try:
+                    messages = await self.fetch_new(call_action, group_id)
+                except Exception as e:
+                    logger.error("获取群 %s 历史消息失败: %s", group_id, e)
+                    continue
+                if not messages:
+                    continue
+                seen = await self.store.contains_many(
+                    "message", [message_key(group_id, m.get("message_id")) for m in messages]
+                )
+                pending = [m for m in messages if message_key(group_id, m.get("message_id")) not in seen]
+                logger.info(
+                    "群 %s 取回 %s 条历史消息，其中 %s 条未处理", group_id, len(messages), len(pending)
+                )
+                for message in pending:
+                    try:
+                        await handler(str(group_id), message)
+                        fed += 1
+                    except Exception as e:
+                        logger.error("补漏消息 %s 处理失败: %s", message.get("message_id"), e)
+                    if self.rate > 0:
+                        await asyncio.sleep(1 / self.rate)
+                # 下次补漏从当前水位开始
+                current = self._marks.get(str(group_id))
+                if current is not None:
+                    self._start_marks[str(group_id)] = {"time": current["time"], "ids": list(current["ids"])}
+        finally:
+            self.running = False
+            await asyncio.to_thread(self.save)
+        return fed
@@ -0,0 +1,100 @@
+# bloom.py
+import hashlib
+import math
+import struct
+
+_MAGIC = b"SBF1"
+_HEADER = struct.Struct("<4sQdI")
+_FILTER_HEADER = struct.Struct("<QdQIQ")
+
+
+class BloomFilter:
+    """定长布隆过滤器，双重哈希生成 k 个位置"""
+
+    def __init__(self, capacity: int, error_rate: float, num_bits: int = 0, num_hashes: int = 0,
+                 count: int = 0, bits: bytearray = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = num_bits or max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def add(self, key: str):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """可扩容布隆过滤器 - 写满后追加容量翻倍、误判率收紧的新过滤器，整体误判率有上界"""
+
+    def __init__(self, initial_capacity: int = 100_000, error_rate: float = 0.001,
+                 growth: int = 2, tightening: float = 0.9):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def __contains__(self, key: str) -> bool:
+        return any(key in f for f in self.filters)
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(f.bits) for f in self.filters)
+
+    def add(self, key: str) -> bool:
+        """加入 key，已（可能）存在时返回 False"""
+        if key in self:
+            return False
+        if not self.filters or self.filters[-1].full:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.growth ** n,
+                self.error_rate * (1 - self.tightening) * self.tightening ** n,
+            ))
+        self.filters[-1].add(key)
+        return True
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_MAGIC, self.initial_capacity, self.error_rate, len(self.filters))]
+        for f in list(self.filters):
+            parts.append(_FILTER_HEADER.pack(f.capacity, f.error_rate, f.num_bits, f.num_hashes, f.count))
+            parts.append(bytes(f.bits))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0):
+        """从 data[offset:] 解析，返回 (过滤器, 结束位置)"""
+        magic, capacity, error_rate, n = _HEADER.unpack_from(data, offset)
+        if magic != _MAGIC:
+            raise ValueError("不是布隆过滤器快照")
+        offset += _HEADER.size
+        sbf = cls(capacity, error_rate)
+        for _ in range(n):
+            cap, err, num_bits, num_hashes, count = _FILTER_HEADER.unpack_from(data, offset)
+            offset += _FILTER_HEADER.size
+            size = (num_bits + 7) // 8
+            bits = bytearray(data[offset:offset + size])
+            offset += size
+            sbf.filters.append(BloomFilter(cap, err, num_bits, num_hashes, count, bits))
+        return sbf, offset
@@ -0,0 +1,109 @@
+# cache_index.py
+import random
+from collections import deque
+
+
+class CacheIndex:
+    """缓存索引 - 每种类型一个稠密 id 数组，增删和随机抽取均为 O(1)"""
+
+    def __init__(self):
+        self._ids = {}  # kind -> [msg_id, ...]
+        self._pos = {}  # msg_id -> (kind, 数组下标)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, msg_id):
+        return str(msg_id) in self._pos
+
+    def count(self, kind: str) -> int:
+        return len(self._ids.get(kind, []))
+
+    def kind_of(self, msg_id):
+        entry = self._pos.get(str(msg_id))
+        return entry[0] if entry else None
+
+    def add(self, msg_id, kind: str = "forward"):
+        """加入索引，已存在时更新类型"""
+        msg_id = str(msg_id)
+        if msg_id in self._pos:
+            if self._pos[msg_id][0] == kind:
+                return
+            self.remove(msg_id)
+        ids = self._ids.setdefault(kind, [])
+        self._pos[msg_id] = (kind, len(ids))
+        ids.append(msg_id)
+
+    def remove(self, msg_id) -> bool:
+        """与数组末尾元素交换后弹出，避免整体移动"""
+        msg_id = str(msg_id)
+        entry = self._pos.pop(msg_id, None)
+        if entry is None:
+            return False
+        kind, idx = entry
+        ids = self._ids[kind]
+        last = ids.pop()
+        if last != msg_id:
+            ids[idx] = last
+            self._pos[last] = (kind, idx)
+        return True
+
+    def ids(self) -> list:
+        return list(self._pos)
+
+    def to_dict(self) -> dict:
+        """导出为 {msg_id: kind}，用于持久化"""
+        return {msg_id: kind for msg_id, (kind, _) in self._pos.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        index = cls()
+        for msg_id, kind in data.items():
+            index.add(msg_id, kind)
+        return index
+
+    def sample(self, weights: dict = None, exclude=None, attempts: int = 8):
+        """随机抽取一个 msg_id
+
+        weights 为 {kind: 权重}，先按权重选类型，再在该类型内均匀抽取；
+        exclude 中的 id 会被跳过，重试 attempts 次后仍命中则照常返回。
+        """
+        kinds = [k for k, ids in self._ids.items() if ids]
+        if weights:
+            kinds = [k for k in kinds if weights.get(k, 0) > 0]
+        if not kinds:
+            return None
+        kind_weights = [weights[k] for k in kinds] if weights else [len(self._ids[k]) for k in kinds]
+
+        candidate = None
+        for _ in range(max(1, attempts)):
+            kind = random.choices(kinds, weights=kind_weights)[0]
+            ids = self._ids[kind]
+            candidate = ids[random.randrange(len(ids))]
+            if not exclude or candidate not in exclude:
+                break
+        return candidate
+
+
+class RecentWindow:
+    """每个群最近抽取过的 id，用于避免短时间内重复"""
+
+    def __init__(self, size: int = 20):
+        self.size = max(0, size)
+        self._recent = {}  # group_id -> (deque, set)
+
+    def get(self, group_id) -> set:
+        entry = self._recent.get(str(group_id))
+        return entry[1] if entry else set()
+
+    def push(self, group_id, msg_id):
+        if not self.size:
+            return
+        order, members = self._recent.setdefault(str(group_id), (deque(), set()))
+        msg_id = str(msg_id)
+        if msg_id in members:
+            return
+        order.append(msg_id)
+        members.add(msg_id)
+        if len(order) > self.size:
+            members.discard(order.popleft())
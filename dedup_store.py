@@ -0,0 +1,527 @@
+# dedup_store.py
+import asyncio
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from .bloom import ScalableBloomFilter
+from .log import get_logger
+from .snapshot import dump_bytes, dump_in_background, load_bytes
+
+logger = get_logger("dedup_store", "DedupStore")
+
+DEFAULT_DB_PATH = "data/plugins_data/astrbot_plugin_fuckanka/dedup.db"
+# 去重库不放在 temp 下，过期由时间窗口负责，不随每日清理一起清空
+LOCAL_DB_PATH = "data/plugins_data/astrbot_plugin_fuckanka/dedup_local.db"
+
+# 各类内容默认的去重窗口（天），0 表示永久；message 为已处理的源消息 ID，供补漏时跳过
+DEFAULT_WINDOWS = {"forward": 30, "image": 30, "video": 30, "text": 7, "message": 3}
+
+# 按东八区自然日分桶
+_DAY_SECONDS = 86400
+_TZ_OFFSET = 8 * 3600
+
+# 布隆快照回放时向前多取的秒数，覆盖快照序列化期间写入的记录
+_REPLAY_MARGIN = 5.0
+# 批量查询时每条 SQL 的键数，低于 SQLite 默认的参数个数上限
+_IN_CHUNK = 500
+# 批量写入/删除时每个事务的行数
+_WRITE_CHUNK = 500
+# 事件循环中等待写锁的上限（秒），超过后转到线程中用长超时重试
+_FAST_TIMEOUT = 0.02
+_SLOW_TIMEOUT = 5
+# 新增多少条记录后异步保存一次布隆快照
+_SAVE_EVERY = 1000
+_SNAPSHOT_MAGIC = b"DDB2"
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    message = str(e).lower()
+    return "locked" in message or "busy" in message
+
+
+def day_bucket(ts: float = None) -> int:
+    """时间戳所在的日桶编号"""
+    return int(((time.time() if ts is None else ts) + _TZ_OFFSET) // _DAY_SECONDS)
+
+
+class DedupStore(ABC):
+    """去重存储接口 - 按命名空间（forward、image、video、text、message）记录已处理的键
+
+    记录按日分桶，每个命名空间只在最近 N 个桶内判重；过期时整桶丢弃，不逐条扫描。
+    窗口为 0 的命名空间所有记录都写入 0 号桶，永不过期。
+    """
+
+    # 是否跨进程共享；共享存储由多个 bot 进程同时读写
+    shared = False
+    # 重启后记录是否还在
+    persistent = False
+
+    def __init__(self, windows: dict = None):
+        self.windows = {**DEFAULT_WINDOWS, **(windows or {})}
+
+    def _bucket_for(self, namespace: str, today: int) -> int:
+        return today if self.windows.get(namespace, 0) > 0 else 0
+
+    def _min_live(self, namespace: str, today: int) -> int:
+        """仍在窗口内的最早桶编号"""
+        days = self.windows.get(namespace, 0)
+        return today - days + 1 if days > 0 else 0
+
+    async def warm_up(self):
+        """加载内存结构，可重复调用"""
+
+    async def expire(self):
+        """丢弃所有命名空间中已滑出窗口的桶"""
+
+    @abstractmethod
+    async def check_and_add(self, namespace: str, key: str) -> bool:
+        """原子地检查并写入，窗口内已存在返回 True"""
+
+    @abstractmethod
+    async def contains(self, namespace: str, key: str) -> bool:
+        """窗口内是否已存在，不写入"""
+
+    async def contains_many(self, namespace: str, keys) -> set:
+        """批量判重，返回窗口内已存在的键"""
+        return {key for key in keys if await self.contains(namespace, key)}
+
+    @abstractmethod
+    def add_many(self, namespace: str, keys):
+        """批量写入（同步，导入旧数据时在线程中调用）"""
+
+    @abstractmethod
+    async def discard(self, namespace: str, key: str):
+        """删除一个键"""
+
+    def close(self):
+        pass
+
+
+class MemoryDedupStore(DedupStore):
+    """进程内存储，重启后清空，适合测试或临时使用"""
+
+    def __init__(self, windows: dict = None):
+        super().__init__(windows)
+        self._buckets = {}  # namespace -> {bucket: set}
+
+    def _live_sets(self, namespace, today):
+        min_live = self._min_live(namespace, today)
+        return [keys for bucket, keys in self._buckets.get(namespace, {}).items() if bucket >= min_live]
+
+    def _add(self, namespace, key, today):
+        buckets = self._buckets.setdefault(namespace, {})
+        buckets.setdefault(self._bucket_for(namespace, today), set()).add(key)
+
+    async def check_and_add(self, namespace, key):
+        today = day_bucket()
+        if any(key in keys for keys in self._live_sets(namespace, today)):
+            return True
+        self._add(namespace, key, today)
+        return False
+
+    async def contains(self, namespace, key):
+        return any(key in keys for keys in self._live_sets(namespace, day_bucket()))
+
+    def add_many(self, namespace, keys):
+        today = day_bucket()
+        for key in keys:
+            self._add(namespace, key, today)
+
+    async def discard(self, namespace, key):
+        for keys in self._buckets.get(namespace, {}).values():
+            keys.discard(key)
+
+    async def expire(self):
+        today = day_bucket()
+        for namespace, buckets in self._buckets.items():
+            min_live = self._min_live(namespace, today)
+            for bucket in [b for b in buckets if b < min_live]:
+                del buckets[bucket]
+
+
+class SqliteDedupStore(DedupStore):
+    """SQLite 存储（WAL 模式），同一台机器上的多个 bot 进程可共享一个文件
+
+    检查并写入是一条 UPSERT：键不存在或所在桶已过期时写入今天的桶，否则什么也不做，
+    判断与写入在同一条语句内，不会出现两个进程同时判定为“未发送”的情况。
+    事件循环中的查询走单独的连接，等锁上限很短，主键查询照常在微秒级完成；
+    其他进程正持有写锁时不在事件循环里等，转到线程中用长超时重试。
+    批量导入和过期删除在线程中分批提交，每个事务只持有写锁很短的时间。
+    """
+
+    shared = True
+    persistent = True
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, windows: dict = None):
+        super().__init__(windows)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 事件循环用的连接
+        self._lock = threading.Lock()
+        self._conn = self._connect(_FAST_TIMEOUT)
+        # 线程中用的连接：批量写入、过期删除、快照回放，以及事件循环查询遇到锁时的重试
+        self._bg_lock = threading.Lock()
+        self._bg_conn = self._connect(_SLOW_TIMEOUT)
+        self._bg_conn.execute("PRAGMA journal_mode=WAL")
+        self._bg_conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL, "
+            "bucket INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._migrate()
+        self._bg_conn.execute("CREATE INDEX IF NOT EXISTS dedup_created_at ON dedup (created_at)")
+        self._bg_conn.execute("CREATE INDEX IF NOT EXISTS dedup_bucket ON dedup (namespace, bucket)")
+        logger.info("使用去重库: %s", path)
+
+    def _connect(self, timeout: float):
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _has_bucket(conn) -> bool:
+        return "bucket" in {row[1] for row in conn.execute("PRAGMA table_info(dedup)")}
+
+    def _migrate(self):
+        """旧表没有 bucket 列：按写入时间补齐；旧的 md5 命名空间拆分为 image 和 video"""
+        conn = self._bg_conn
+        if self._has_bucket(conn):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 多个进程同时启动时，拿到写锁后再确认一次，迁移可能已由其他进程完成
+            if self._has_bucket(conn):
+                conn.execute("COMMIT")
+                return
+            conn.execute("ALTER TABLE dedup ADD COLUMN bucket INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "UPDATE dedup SET bucket = CAST((created_at + ?) / ? AS INTEGER)", (_TZ_OFFSET, _DAY_SECONDS)
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO dedup (namespace, key, created_at, bucket) "
+                "SELECT 'video', key, created_at, bucket FROM dedup WHERE namespace = 'md5'"
+            )
+            conn.execute("UPDATE OR IGNORE dedup SET namespace = 'image' WHERE namespace = 'md5'")
+            conn.execute("DELETE FROM dedup WHERE namespace = 'md5'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    _UPSERT = (
+        "INSERT INTO dedup (namespace, key, created_at, bucket) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (namespace, key) DO UPDATE SET created_at = excluded.created_at, bucket = excluded.bucket "
+        "WHERE dedup.bucket < ?"
+    )
+
+    async def _call(self, fn, *args):
+        """先在事件循环中用短超时执行 fn(conn, *args)，库被其他写者锁住时转到线程中等待"""
+        try:
+            with self._lock:
+                return fn(self._conn, *args)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+        logger.sampled(logging.DEBUG, "sqlite_busy", "去重库被其他写者占用，转到线程中等待")
+        return await asyncio.to_thread(self._call_bg, fn, *args)
+
+    def _call_bg(self, fn, *args):
+        with self._bg_lock:
+            return fn(self._bg_conn, *args)
+
+    def _check_and_add(self, conn, namespace, key):
+        today = day_bucket()
+        cur = conn.execute(
+            self._UPSERT,
+            (namespace, key, time.time(), self._bucket_for(namespace, today), self._min_live(namespace, today)),
+        )
+        return cur.rowcount == 0
+
+    def _contains(self, conn, namespace, key):
+        row = conn.execute(
+            "SELECT 1 FROM dedup WHERE namespace = ? AND key = ? AND bucket >= ?",
+            (namespace, key, self._min_live(namespace, day_bucket())),
+        ).fetchone()
+        return row is not None
+
+    def _contains_many(self, conn, namespace, keys):
+        min_live = self._min_live(namespace, day_bucket())
+        found = set()
+        for i in range(0, len(keys), _IN_CHUNK):
+            chunk = keys[i:i + _IN_CHUNK]
+            rows = conn.execute(
+                f"SELECT key FROM dedup WHERE namespace = ? AND bucket >= ? "
+                f"AND key IN ({','.join('?' * len(chunk))})",
+                (namespace, min_live, *chunk),
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def _discard(self, conn, namespace, key):
+        conn.execute("DELETE FROM dedup WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def check_and_add(self, namespace, key):
+        return await self._call(self._check_and_add, namespace, key)
+
+    async def contains(self, namespace, key):
+        return await self._call(self._contains, namespace, key)
+
+    async def contains_many(self, namespace, keys):
+        return await self._call(self._contains_many, namespace, list(dict.fromkeys(keys)))
+
+    async def discard(self, namespace, key):
+        await self._call(self._discard, namespace, key)
+
+    def add_many(self, namespace, keys):
+        now = time.time()
+        today = day_bucket(now)
+        bucket, min_live = self._bucket_for(namespace, today), self._min_live(namespace, today)
+        keys = list(keys)
+        # 分批提交，每批之间释放写锁，其他进程的查询不会被整段导入卡住
+        for i in range(0, len(keys), _WRITE_CHUNK):
+            rows = [(namespace, key, now, bucket, min_live) for key in keys[i:i + _WRITE_CHUNK]]
+            with self._bg_lock:
+                self._bg_conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._bg_conn.executemany(self._UPSERT, rows)
+                    self._bg_conn.execute("COMMIT")
+                except Exception:
+                    self._bg_conn.execute("ROLLBACK")
+                    raise
+
+    def iter_entries(self, since: float = 0.0, batch: int = 10000):
+        """遍历 created_at >= since 的 (namespace, key, bucket)
+
+        since > 0 时只取最近写入的少量记录，走 created_at 索引一次取完；
+        全量遍历按主键分页，每页之间释放锁。在线程中调用。
+        """
+        if since > 0:
+            with self._bg_lock:
+                rows = self._bg_conn.execute(
+                    "SELECT namespace, key, bucket FROM dedup WHERE created_at >= ?", (since,)
+                ).fetchall()
+            yield from rows
+            return
+        last = ("", "")
+        while True:
+            with self._bg_lock:
+                rows = self._bg_conn.execute(
+                    "SELECT namespace, key, bucket FROM dedup WHERE (namespace, key) > (?, ?) "
+                    "ORDER BY namespace, key LIMIT ?",
+                    (last[0], last[1], batch),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][:2]
+
+    def _delete_expired(self) -> int:
+        today = day_bucket()
+        removed = 0
+        for namespace, days in self.windows.items():
+            if days <= 0:
+                continue
+            min_live = self._min_live(namespace, today)
+            # 每次删一批，单个事务持有写锁的时间有上限
+            while True:
+                with self._bg_lock:
+                    cur = self._bg_conn.execute(
+                        "DELETE FROM dedup WHERE (namespace, key) IN ("
+                        "SELECT namespace, key FROM dedup WHERE namespace = ? AND bucket < ? LIMIT ?)",
+                        (namespace, min_live, _WRITE_CHUNK),
+                    )
+                removed += cur.rowcount
+                if cur.rowcount < _WRITE_CHUNK:
+                    break
+        return removed
+
+    async def expire(self):
+        # 按 (namespace, bucket) 索引分批删除，只触及过期的记录
+        removed = await asyncio.to_thread(self._delete_expired)
+        if removed:
+            logger.info("已清除 %s 条过期去重记录", removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        with self._bg_lock:
+            self._bg_conn.close()
+
+
+class BloomDedupStore(DedupStore):
+    """布隆过滤器前置的单进程存储
+
+    每个 (命名空间, 日桶) 一个可扩容布隆过滤器常驻内存，精确记录只在 SQLite 中。
+    窗口内所有桶的过滤器都判定“不存在”时 contains 不访问磁盘；否则再查精确库。
+    过期时直接丢弃整个桶的过滤器，内存随窗口保持稳定。
+    过滤器定期写入快照，启动时读取快照并回放快照之后写入的记录，崩溃也不会漏判。
+    多进程共享时其他进程的写入不会进入本进程的过滤器，因此只用于本地单进程。
+    """
+
+    persistent = True
+
+    def __init__(self, path: str = LOCAL_DB_PATH, windows: dict = None):
+        super().__init__(windows)
+        self.exact = SqliteDedupStore(path, self.windows)
+        self.snapshot_path = f"{path}.bloom"
+        self._filters = {}  # namespace -> {bucket: ScalableBloomFilter}
+        self._pending = 0
+        self._warm_up_task = None
+
+    def _filter(self, namespace, bucket) -> ScalableBloomFilter:
+        buckets = self._filters.setdefault(namespace, {})
+        if bucket not in buckets:
+            buckets[bucket] = ScalableBloomFilter(initial_capacity=10_000)
+        return buckets[bucket]
+
+    def _maybe_contains(self, namespace, key, today) -> bool:
+        min_live = self._min_live(namespace, today)
+        return any(
+            key in sbf for bucket, sbf in self._filters.get(namespace, {}).items() if bucket >= min_live
+        )
+
+    async def warm_up(self):
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.ensure_future(self._warm_up())
+        await asyncio.shield(self._warm_up_task)
+
+    async def _warm_up(self):
+        await asyncio.to_thread(self._load)
+        await self.expire()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            since = self._read_snapshot()
+        except Exception as e:
+            logger.warning("布隆快照无法读取，将从去重库重建: %s", e)
+            self._filters = {}
+            since = 0.0
+        replayed = 0
+        for namespace, key, bucket in self.exact.iter_entries(since):
+            self._filter(namespace, bucket).add(key)
+            replayed += 1
+        elapsed = (time.perf_counter() - start) * 1000
+        filters = [sbf for buckets in self._filters.values() for sbf in buckets.values()]
+        logger.info(
+            "布隆过滤器已就绪: %s 个桶 %s 条记录（回放 %s 条），占用 %.1f KB，耗时 %.1f ms",
+            len(filters), sum(len(f) for f in filters), replayed,
+            sum(f.nbytes for f in filters) / 1024, elapsed,
+        )
+
+    def _read_snapshot(self) -> float:
+        """读取快照，返回需要从精确库回放的起始时间"""
+        data = load_bytes(self.snapshot_path)
+        if not data:
+            return 0.0
+        magic, saved_at, n = struct.unpack_from("<4sdI", data, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("快照版本不匹配")
+        offset = struct.calcsize("<4sdI")
+        filters = {}
+        for _ in range(n):
+            (name_len,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            namespace = data[offset:offset + name_len].decode("utf-8")
+            offset += name_len
+            (bucket,) = struct.unpack_from("<q", data, offset)
+            offset += 8
+            filters.setdefault(namespace, {})[bucket], offset = ScalableBloomFilter.from_bytes(data, offset)
+        self._filters = filters
+        return max(0.0, saved_at - _REPLAY_MARGIN)
+
+    def _snapshot_bytes(self) -> bytes:
+        entries = [
+            (namespace, bucket, sbf)
+            for namespace, buckets in list(self._filters.items())
+            for bucket, sbf in list(buckets.items())
+        ]
+        parts = [struct.pack("<4sdI", _SNAPSHOT_MAGIC, time.time(), len(entries))]
+        for namespace, bucket, sbf in entries:
+            name = namespace.encode("utf-8")
+            parts.append(struct.pack("<H", len(name)) + name + struct.pack("<q", bucket))
+            parts.append(sbf.to_bytes())
+        return b"".join(parts)
+
+    def save_snapshot(self):
+        try:
+            dump_bytes(self.snapshot_path, self._snapshot_bytes())
+            self._pending = 0
+        except Exception as e:
+            logger.error("保存布隆快照失败: %s", e)
+
+    def _mark_added(self, count=1):
+        self._pending += count
+        if self._pending < _SAVE_EVERY:
+            return
+        self._pending = 0
+        # 在事件循环中复制位数组（内存拷贝很快），写文件交给线程
+        dump_in_background(self.snapshot_path, self._snapshot_bytes())
+
+    async def check_and_add(self, namespace, key):
+        today = day_bucket()
+        existed = await self.exact.check_and_add(namespace, key)
+        if not existed:
+            self._filter(namespace, self._bucket_for(namespace, today)).add(key)
+            self._mark_added()
+        return existed
+
+    async def contains(self, namespace, key):
+        if not self._maybe_contains(namespace, key, day_bucket()):
+            return False
+        return await self.exact.contains(namespace, key)
+
+    async def contains_many(self, namespace, keys):
+        # 过滤器判定不存在的键不再查库
+        today = day_bucket()
+        candidates = [key for key in keys if self._maybe_contains(namespace, key, today)]
+        return await self.exact.contains_many(namespace, candidates) if candidates else set()
+
+    def add_many(self, namespace, keys):
+        keys = list(keys)
+        self.exact.add_many(namespace, keys)
+        sbf = self._filter(namespace, self._bucket_for(namespace, day_bucket()))
+        for key in keys:
+            sbf.add(key)
+        self._mark_added(len(keys))
+
+    async def discard(self, namespace, key):
+        # 布隆过滤器不支持删除，残留的位只会导致一次多余的精确查询
+        await self.exact.discard(namespace, key)
+
+    async def expire(self):
+        today = day_bucket()
+        dropped = 0
+        for namespace, buckets in self._filters.items():
+            min_live = self._min_live(namespace, today)
+            for bucket in [b for b in buckets if b < min_live]:
+                del buckets[bucket]
+                dropped += 1
+        if dropped:
+            logger.info("已丢弃 %s 个过期的布隆过滤器桶", dropped)
+        await self.exact.expire()
+
+    def close(self):
+        if self._warm_up_task is not None and self._warm_up_task.done():
+            self.save_snapshot()
+        self.exact.close()
+
+
+def create_dedup_store(config: dict) -> DedupStore:
+    """根据插件配置创建去重存储"""
+    windows = {
+        namespace: int(config.get(f"dedup_window_{namespace}_days", days))
+        for namespace, days in DEFAULT_WINDOWS.items()
+    }
+    backend = str(config.get("dedup_backend", "local")).lower()
+    if backend == "sqlite":
+        return SqliteDedupStore(config.get("dedup_db_path") or DEFAULT_DB_PATH, windows)
+    if backend == "memory":
+        return MemoryDedupStore(windows)
+    if backend != "local":
+        logger.warning("未知的去重后端 %s，使用本地存储", backend)
+    return BloomDedupStore(windows=windows)
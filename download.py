@@ -1,44 +1,126 @@
 # download.py
 import asyncio
+import hashlib
+import logging
 import os
+import time
 import traceback
 import uuid
+from collections import OrderedDict
 import requests
-from astrbot.api import logger
+from .log import get_logger
+from .singleflight import SingleFlight
+
+logger = get_logger("download", "MediaDownloader")
+
+CHUNK_SIZE = 64 * 1024
+
+# 各类媒体的默认大小上限（字节），0 表示不限制
+DEFAULT_SIZE_LIMITS = {
+    "image": 20 * 1024 * 1024,
+    "video": 200 * 1024 * 1024,
+    "record": 20 * 1024 * 1024,
+}
+
+
+# 开头多少字节参与提前查重，0 为不提前查重
+DEFAULT_HEAD_BYTES = 64 * 1024
+# 最多保留多少个文件的下载时 MD5，下载后未发送的文件不会一直占用内存
+_MD5_ENTRIES = 256
+
+
+class OversizeError(Exception):
+    """媒体文件超过大小上限"""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"{size} bytes > 上限 {limit} bytes")
+        self.size = size
+        self.limit = limit
+
+
+class DuplicateMediaError(Exception):
+    """文件开头与已发送过的文件相同"""
+
 
 class MediaDownloader:
     """媒体下载器 - 带详细调试日志"""
 
-    def __init__(self, temp_dir: str = None):
+    def __init__(self, temp_dir: str = None, size_limits: dict = None, max_retries: int = 3,
+                 store=None, head_bytes: int = DEFAULT_HEAD_BYTES):
         self.temp_dir = temp_dir or "data/plugins_data/astrbot_plugin_fuckanka/temp"
+        self.size_limits = {**DEFAULT_SIZE_LIMITS, **(size_limits or {})}
+        self.max_retries = max(1, max_retries)
+        # 提前查重：收到开头 head_bytes 字节后，按“文件大小 + 开头摘要”查去重存储，已发送过则放弃下载
+        self.store = store
+        self.head_bytes = max(0, head_bytes)
+        # 已下载图片/视频路径 -> 下载过程中计算的 MD5，发送端查重时取出
+        self.file_md5 = OrderedDict()
+        self._flight = SingleFlight()
         # 确保目录存在
         os.makedirs(self.temp_dir, exist_ok=True)
-        logger.info(f"[MediaDownloader] 临时目录: {self.temp_dir}")
+        logger.info("临时目录: %s", self.temp_dir)
 
     def _is_tencent_multimedia_url(self, url: str) -> bool:
         """检查是否是腾讯多媒体链接"""
         is_tencent = url and ("multimedia.nt.qq.com.cn" in url or "multimedia.nt.qq.com" in url)
-        logger.debug(f"[MediaDownloader] URL检测: {url} -> 腾讯链接: {is_tencent}")
+        logger.debug("URL检测: %s -> 腾讯链接: %s", url, is_tencent)
         return is_tencent
 
-    async def download_file(self, url: str, file_type: str) -> str:
-        """通用文件下载方法"""
-        logger.info(f"[MediaDownloader] 开始下载: {url}")
+    def _part_path(self, url: str, file_type: str) -> str:
+        """同一 URL 对应固定的 .part 文件，中断后可据此续传"""
+        key = hashlib.md5(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.temp_dir, f"{key}.{file_type}.part")
+
+    def _head_key(self, part_path: str, total: int) -> str:
+        """提前查重的键：文件总大小 + 开头 head_bytes 字节的 MD5"""
+        with open(part_path, "rb") as f:
+            head = f.read(self.head_bytes)
+        return f"head:{total}:{hashlib.md5(head).hexdigest()}"
+
+    def _seen_head(self, loop, kind: str, key: str) -> bool:
+        """在下载线程中查询去重存储；查询失败时照常下载"""
+        try:
+            return asyncio.run_coroutine_threadsafe(self.store.contains(kind, key), loop).result(timeout=5)
+        except Exception as e:
+            logger.debug("提前查重失败，继续下载: %s", e)
+            return False
+
+    @staticmethod
+    def _expected_total(response, offset: int) -> int:
+        """根据响应头推断文件总大小，未知时返回 0"""
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[-1]
+            return int(total) if total.isdigit() else 0
+        length = response.headers.get("Content-Length", "")
+        return offset + int(length) if length.isdigit() else 0
+
+    async def download_file(self, url: str, file_type: str, max_size: int = 0, dedup_kind: str = None) -> str:
+        """通用文件下载方法
+
+        max_size 为 0 表示不限制大小；超过限制时在读取正文前（或一旦超出时）立即放弃。
+        下载写入 .part 文件，网络中断后使用 Range 请求从已有位置续传。
+        dedup_kind 为发送端查重使用的命名空间（image / video）：保留下载过程中计算的 MD5 供 get_file_md5 取出；
+        已知文件大小时，收到开头 head_bytes 字节就按大小和开头摘要查重，与已发送的文件相同则放弃下载剩余部分。
+        """
+        logger.debug("开始下载: %s", url)
         
         if not url:
-            logger.warning("[MediaDownloader] URL为空，无法下载")
+            logger.warning("URL为空，无法下载")
             return ""
 
         # 生成文件名和路径
         filename = f"{uuid.uuid4()}.{file_type}"
         filepath = os.path.join(self.temp_dir, filename)
+        part_path = self._part_path(url, file_type)
         
-        logger.debug(f"[MediaDownloader] 目标文件路径: {filepath}")
+        logger.debug("目标文件路径: %s", filepath)
+
+        loop = asyncio.get_running_loop()
+        early_check = bool(dedup_kind and self.store is not None and self.head_bytes)
 
         try:
             def _download():
-                logger.debug(f"[MediaDownloader] 开始HTTP请求: {url}")
-                
                 # 设置请求头
                 headers = {
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
@@ -46,108 +128,194 @@ class MediaDownloader:
                     "Accept": "*/*",
                     "Connection": "keep-alive"
                 }
-                
-                response = requests.get(url, stream=True, timeout=30, headers=headers, verify=True)
-                
-                logger.debug(f"[MediaDownloader] 响应状态码: {response.status_code}")
-                logger.debug(f"[MediaDownloader] 内容类型: {response.headers.get('Content-Type', '未知')}")
-                
-                response.raise_for_status()
-                
-                # 写入文件
-                total_size = 0
-                with open(filepath, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            total_size += len(chunk)
-                
-                logger.info(f"[MediaDownloader] 下载完成，大小: {total_size} bytes")
-                return total_size
 
-            downloaded_size = await asyncio.to_thread(_download)
+                for attempt in range(1, self.max_retries + 1):
+                    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                    request_headers = dict(headers)
+                    if offset:
+                        request_headers["Range"] = f"bytes={offset}-"
+                    logger.debug("开始HTTP请求(第%s次, 偏移=%s): %s", attempt, offset, url)
+
+                    try:
+                        with requests.get(url, stream=True, timeout=30, headers=request_headers, verify=True) as response:
+                            logger.debug("响应状态码: %s", response.status_code)
+                            logger.debug("内容类型: %s", response.headers.get('Content-Type', '未知'))
+
+                            if response.status_code == 416:
+                                # 续传位置无效（服务器文件已变化），从头开始
+                                os.remove(part_path)
+                                continue
+                            response.raise_for_status()
+
+                            resumed = offset > 0 and response.status_code == 206
+                            if not resumed:
+                                offset = 0
+                            total = self._expected_total(response, offset)
+                            if max_size and total > max_size:
+                                raise OversizeError(total, max_size)
+
+                            # 边下载边计算 MD5，发送端无需再读一遍文件
+                            hasher = hashlib.md5()
+                            if resumed:
+                                with open(part_path, "rb") as f:
+                                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                                        hasher.update(chunk)
+
+                            head_key = ""
+                            with open(part_path, "ab" if resumed else "wb") as f:
+                                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                                    if not chunk:
+                                        continue
+                                    f.write(chunk)
+                                    hasher.update(chunk)
+                                    offset += len(chunk)
+                                    if max_size and offset > max_size:
+                                        raise OversizeError(offset, max_size)
+                                    if early_check and total and not head_key and offset >= min(self.head_bytes, total):
+                                        f.flush()
+                                        head_key = self._head_key(part_path, total)
+                                        if self._seen_head(loop, dedup_kind, head_key):
+                                            raise DuplicateMediaError(head_key)
+
+                            if total and offset < total:
+                                raise requests.exceptions.ChunkedEncodingError(
+                                    f"连接提前结束: {offset}/{total} bytes"
+                                )
+
+                        logger.info("下载完成，大小: %s bytes", offset)
+                        return offset, hasher.hexdigest(), head_key
+                    except (OversizeError, DuplicateMediaError):
+                        if os.path.exists(part_path):
+                            os.remove(part_path)
+                        raise
+                    except requests.exceptions.RequestException as e:
+                        if attempt >= self.max_retries:
+                            raise
+                        logger.warning("下载中断(%s)，%s秒后续传", e, attempt)
+                        time.sleep(attempt)
+
+                raise requests.exceptions.RetryError(f"超过最大重试次数: {url}")
+
+            downloaded_size, md5, head_key = await asyncio.to_thread(_download)
+            await asyncio.to_thread(os.replace, part_path, filepath)
 
             # 验证文件
             if os.path.exists(filepath):
                 actual_size = os.path.getsize(filepath)
-                logger.debug(f"[MediaDownloader] 文件检查: 路径={filepath}, 大小={actual_size} bytes")
+                logger.debug("文件检查: 路径=%s, 大小=%s bytes", filepath, actual_size)
                 
                 if actual_size > 0:
+                    if dedup_kind:
+                        self.file_md5[filepath] = md5
+                        while len(self.file_md5) > _MD5_ENTRIES:
+                            self.file_md5.popitem(last=False)
+                    if head_key:
+                        # 记下开头摘要，之后再出现同样的文件时不必下载完整内容
+                        await self.store.check_and_add(dedup_kind, head_key)
                     if actual_size == downloaded_size:
-                        logger.info(f"[MediaDownloader] 下载验证成功: {filepath}")
+                        logger.debug("下载验证成功: %s", filepath)
                         return filepath
                     else:
-                        logger.warning(f"[MediaDownloader] 文件大小不匹配: 预期={downloaded_size}, 实际={actual_size}")
+                        logger.warning("文件大小不匹配: 预期=%s, 实际=%s", downloaded_size, actual_size)
                         # 仍然返回文件路径，让sender尝试发送
                         return filepath
                 else:
-                    logger.warning(f"[MediaDownloader] 文件大小为0")
+                    logger.warning("文件大小为0")
                     try:
                         os.remove(filepath)
                     except:
                         pass
-                        logger.warning(f"[MediaDownloader] 文件大小为0,remove失败")
+                        logger.warning("文件大小为0,remove失败")
                     return ""
             else:
-                logger.warning(f"[MediaDownloader] 文件不存在: {filepath}")
+                logger.warning("文件不存在: %s", filepath)
                 return ""
 
+        except OversizeError as e:
+            logger.warning("文件过大，放弃下载: %s", e)
+        except DuplicateMediaError:
+            logger.sampled(logging.INFO, "duplicate_head", "文件开头与已发送的文件相同，放弃下载: %s", url)
         except requests.exceptions.RequestException as e:
-            logger.error(f"[MediaDownloader] 网络请求失败: {e}")
+            logger.error("网络请求失败: %s", e)
         except Exception as e:
-            logger.error(f"[MediaDownloader] 下载异常: {e}")
+            logger.error("下载异常: %s", e)
             logger.error(traceback.format_exc())
         
         return ""
 
-    async def download_image(self, url: str) -> str:
+    @staticmethod
+    def media_identity(media_info: dict) -> str:
+        """媒体的稳定标识：优先使用 OneBot 消息段的 file（内容哈希文件名），其次是 URL"""
+        data = media_info.get("data", {})
+        return str(data.get("file_unique") or data.get("file") or media_info.get("url", ""))
+
+    def get_file_md5(self, file_path: str) -> str:
+        """取出下载时流式计算的 MD5，取出后即移除"""
+        return self.file_md5.pop(file_path, "")
+
+    async def download_image(self, url: str, max_size: int = 0) -> str:
         """下载图片"""
-        logger.info(f"[MediaDownloader] 开始下载图片: {url}")
+        logger.debug("开始下载图片: %s", url)
         file_type = "jpg"
         if "." in url.split("/")[-1]:
             ext = url.split(".")[-1].split("?")[0].lower()  # 去除URL参数
             if ext in ["jpg", "jpeg", "png", "gif", "webp", "bmp"]:
                 file_type = ext
-        logger.debug(f"[MediaDownloader] 图片文件类型推断: {file_type}")
-        return await self.download_file(url, file_type)
+        logger.debug("图片文件类型推断: %s", file_type)
+        return await self.download_file(url, file_type, max_size, dedup_kind="image")
 
-    async def download_video(self, url: str) -> str:
+    async def download_video(self, url: str, max_size: int = 0) -> str:
         """下载视频"""
-        logger.info(f"[MediaDownloader] 开始下载视频: {url}")
+        logger.debug("开始下载视频: %s", url)
         file_type = "mp4"
         if "." in url.split("/")[-1]:
             ext = url.split(".")[-1].split("?")[0].lower()  # 去除URL参数
             if ext in ["mp4", "mov", "webm", "mkv", "flv", "avi"]:
                 file_type = ext
-        logger.debug(f"[MediaDownloader] 视频文件类型推断: {file_type}")
-        return await self.download_file(url, file_type)
+        logger.debug("视频文件类型推断: %s", file_type)
+        return await self.download_file(url, file_type, max_size, dedup_kind="video")
 
-    async def download_audio(self, url: str) -> str:
+    async def download_audio(self, url: str, max_size: int = 0) -> str:
         """下载音频"""
-        logger.info(f"[MediaDownloader] 开始下载音频: {url}")
-        return await self.download_file(url, "mp3")
+        logger.debug("开始下载音频: %s", url)
+        # 语音不经过 MD5 查重，不保留摘要
+        return await self.download_file(url, "mp3", max_size)
 
     async def download_media(self, media_info: dict) -> str:
         """根据媒体信息下载文件"""
         media_type = media_info.get("type", "")
         url = media_info.get("url", "")
 
-        logger.info(f"[MediaDownloader] 处理媒体: 类型={media_type}, URL={url}")
+        logger.debug("处理媒体: 类型=%s, URL=%s", media_type, url)
 
         if not url:
-            logger.warning("[MediaDownloader] 媒体URL为空")
+            logger.warning("媒体URL为空")
+            return ""
+
+        # OneBot 消息段自带 file_size 时，无需发起请求即可拒绝超限文件
+        max_size = self.size_limits.get(media_type, 0)
+        file_size = str(media_info.get("data", {}).get("file_size", "") or "")
+        if max_size and file_size.isdigit() and int(file_size) > max_size:
+            logger.warning("%s 大小 %s bytes 超过上限 %s bytes，跳过下载", media_type, file_size, max_size)
+            return ""
+
+        if media_type == "image":
+            download = self.download_image
+        elif media_type == "video":
+            download = self.download_video
+        elif media_type == "record":
+            download = self.download_audio
+        else:
+            logger.warning("未知媒体类型: %s", media_type)
             return ""
 
+        # 同一媒体并发下载时（如同一帖子出现在两个监听群）只下载一次，共享结果
+        key = (media_type, self.media_identity(media_info))
         try:
-            if media_type == "image":
-                return await self.download_image(url)
-            elif media_type == "video":
-                return await self.download_video(url)
-            elif media_type == "record":
-                return await self.download_audio(url)
-            else:
-                logger.warning(f"[MediaDownloader] 未知媒体类型: {media_type}")
-                return ""
+            path, shared = await self._flight.do(key, lambda: download(url, max_size))
+            if shared:
+                logger.debug("媒体与进行中的下载相同，共享结果: %s", path)
+            return path
         except Exception as e:
-            logger.error(f"[MediaDownloader] 媒体下载异常: {e}")
+            logger.error("媒体下载异常: %s", e)
             return ""
@@ -0,0 +1,154 @@
+# filter_config.py
+import asyncio
+import json
+import os
+import time
+from .log import get_logger
+
+logger = get_logger("filter_config", "FilterConfig")
+
+DEFAULT_MIN_TEXT_LENGTH = 10
+
+
+def _id_set(values) -> frozenset:
+    return frozenset(str(v).strip() for v in values or [] if str(v).strip())
+
+
+def _id_tuple(values) -> tuple:
+    # 目标群保持配置中的顺序，去掉重复项
+    return tuple(dict.fromkeys(str(v).strip() for v in values or [] if str(v).strip()))
+
+
+class GroupRule:
+    """单个监听群的规则：短文本阈值和转发目标，未覆盖的项沿用全局设置"""
+
+    __slots__ = ("min_text_length", "target_groups")
+
+    def __init__(self, min_text_length: int, target_groups: tuple):
+        self.min_text_length = min_text_length
+        self.target_groups = target_groups
+
+
+class FilterConfig:
+    """预编译的过滤配置 - 创建后只读，热重载时整体替换
+
+    每条消息处理开始时取一次引用，处理过程中即使发生重载也始终看到同一份配置。
+    """
+
+    def __init__(self, config: dict, version: int = 1):
+        self.version = version
+        self.loaded_at = time.time()
+        self.monitored_groups = _id_set(config.get("monitored_groups"))
+        self.target_groups = _id_tuple(config.get("target_groups"))
+        self.blacklist_users = _id_set(config.get("blacklist_users"))
+        self.min_text_length = max(0, int(config.get("min_text_length", DEFAULT_MIN_TEXT_LENGTH)))
+        self.default_rule = GroupRule(self.min_text_length, self.target_groups)
+        self.group_rules = self._compile_overrides(config.get("group_overrides"))
+
+    def _compile_overrides(self, items) -> dict:
+        """解析 群号:键=值 形式的按群覆盖，如 123456:min_text_length=0、123456:target_groups=111/222"""
+        overrides = {}
+        for item in items or []:
+            group, sep, rest = str(item).partition(":")
+            name, eq, value = rest.partition("=")
+            group, name, value = group.strip(), name.strip(), value.strip()
+            if not sep or not eq or not group:
+                logger.warning("忽略无法解析的按群配置: %s", item)
+                continue
+            entry = overrides.setdefault(group, {})
+            try:
+                if name == "min_text_length":
+                    entry[name] = max(0, int(value))
+                elif name == "target_groups":
+                    entry[name] = _id_tuple(value.replace(",", "/").split("/"))
+                else:
+                    logger.warning("未知的按群配置项: %s", item)
+            except ValueError:
+                logger.warning("按群配置的值无效: %s", item)
+
+        return {
+            group: GroupRule(
+                entry.get("min_text_length", self.min_text_length),
+                entry.get("target_groups", self.target_groups),
+            )
+            for group, entry in overrides.items()
+        }
+
+    def is_monitored(self, group_id: str) -> bool:
+        """未配置监听群时监听所有群"""
+        return not self.monitored_groups or group_id in self.monitored_groups
+
+    def is_blacklisted(self, user_id: str) -> bool:
+        return user_id in self.blacklist_users
+
+    def rule_for(self, group_id) -> GroupRule:
+        return self.group_rules.get(str(group_id), self.default_rule)
+
+    def targets_for(self, group_id) -> tuple:
+        return self.rule_for(group_id).target_groups
+
+    def is_short_text(self, group_id, text_parts: list, media_list: list = ()) -> bool:
+        """不带媒体的单条纯文本且长度小于阈值；阈值为 0 时不过滤，带图片/视频的短配文不受影响"""
+        if media_list:
+            return False
+        threshold = self.rule_for(group_id).min_text_length
+        return len(text_parts) == 1 and len(text_parts[0]) < threshold
+
+
+class ConfigReloader:
+    """配置热重载 - 轮询配置文件的修改时间，变化后重新编译并原子替换 FilterConfig
+
+    on_reload(config) 在替换前调用，可用于同步更新日志级别等其他设置。
+    """
+
+    def __init__(self, config, interval: float = 5.0, on_reload=None):
+        self.config = config
+        self.interval = interval
+        self.on_reload = on_reload
+        self.path = getattr(config, "config_path", None)
+        self.current = FilterConfig(config)
+        self.last_reload_ms = 0.0
+        self._mtime = self._stat()
+        self._lock = asyncio.Lock()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            return None
+
+    def _read(self) -> dict:
+        with open(self.path, "r", encoding="utf-8-sig") as f:
+            return json.load(f)
+
+    async def reload(self) -> FilterConfig:
+        """重新读取配置文件并替换过滤配置；读取或编译失败时保留旧配置并抛出异常"""
+        async with self._lock:
+            start = time.perf_counter()
+            mtime = await asyncio.to_thread(self._stat)
+            merged = dict(self.config)
+            if self.path:
+                merged.update(await asyncio.to_thread(self._read))
+            compiled = FilterConfig(merged, self.current.version + 1)
+            if self.on_reload:
+                self.on_reload(merged)
+            # 引用赋值是原子的，正在处理的消息仍持有旧对象
+            self.current = compiled
+            self._mtime = mtime
+            self.last_reload_ms = (time.perf_counter() - start) * 1000
+            logger.info("配置已重载，版本 %s，耗时 %.1f ms", compiled.version, self.last_reload_ms)
+            return compiled
+
+    async def run(self):
+        """后台轮询配置文件"""
+        if not self.path or self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await asyncio.to_thread(self._stat) != self._mtime:
+                    await self.reload()
+            except Exception as e:
+                logger.error("配置重载失败，继续使用版本 %s: %s", self.current.version, e)
+                # 同一次修改只报一次错，等文件再次变化后重试
+                self._mtime = await asyncio.to_thread(self._stat)
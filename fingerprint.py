@@ -0,0 +1,172 @@
+# fingerprint.py
+import hashlib
+from collections import OrderedDict
+from .log import get_logger
+from .snapshot import dump_in_background, dump_json, encode_json, load_json
+
+logger = get_logger("fingerprint", "Fingerprint")
+
+# 嵌套转发最多展开的层数，与 ForwardManager.build_nested_nodes 保持一致
+MAX_DEPTH = 3
+# 展开后节点之间、消息段之间的分隔符，避免 ["ab", "c"] 与 ["a", "bc"] 得到相同摘要
+_NODE_SEP = b"\x1e"
+_SEG_SEP = b"\x1f"
+# 新增多少条指纹后保存一次缓存
+_SAVE_EVERY = 50
+
+
+def find_forward_id(message_data: dict) -> str:
+    """取出消息中转发段的 id（合并转发的 resid）"""
+    for comp in message_data.get("message", []) or []:
+        if isinstance(comp, dict) and comp.get("type") == "forward":
+            return str(comp.get("data", {}).get("id", "") or "")
+    return ""
+
+
+def _media_identity(data: dict) -> str:
+    """媒体段的稳定标识：file_unique / file 为内容哈希文件名，转发后保持不变"""
+    ident = data.get("file_unique") or data.get("file") or data.get("url", "")
+    return str(ident).split("?", 1)[0]
+
+
+class ForwardFingerprinter:
+    """聊天记录指纹 - 对展开后的全部节点（文本 + 媒体文件标识）做流式哈希
+
+    指纹按转发 id 缓存（LRU，持久化到磁盘），同一份聊天记录再次出现时无需重新调用 get_forward_msg。
+    """
+
+    def __init__(self, cache_path: str, max_entries: int = 20000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._pending = 0
+
+    def load(self):
+        """加载指纹缓存（同步，应在线程中调用）"""
+        try:
+            data = load_json(self.cache_path, {})
+            self._cache = OrderedDict(data)
+        except Exception as e:
+            logger.error("加载指纹缓存失败: %s", e)
+
+    def save(self):
+        try:
+            dump_json(self.cache_path, dict(self._cache))
+            self._pending = 0
+        except Exception as e:
+            logger.error("保存指纹缓存失败: %s", e)
+
+    def lookup(self, message_data: dict) -> str:
+        """只查缓存，不展开"""
+        forward_id = find_forward_id(message_data)
+        return self._cache.get(forward_id, "") if forward_id else ""
+
+    def _remember(self, forward_id: str, fingerprint: str):
+        self._cache[forward_id] = fingerprint
+        self._cache.move_to_end(forward_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        self._pending += 1
+        if self._pending >= _SAVE_EVERY:
+            self._pending = 0
+            # 在事件循环中编码，写文件交给线程
+            dump_in_background(self.cache_path, encode_json(dict(self._cache)))
+
+    async def fingerprint(self, message_data: dict, fetch=None, texts: list = None) -> str:
+        """计算聊天记录指纹
+
+        fetch(forward_id) 为 get_forward_msg 的协程函数；消息段自带 content 时不需要调用。
+        传入 texts 时，展开过程中的文本和媒体文件名会追加到其中（命中缓存时不展开，不追加）。
+        无法展开时返回空字符串。
+        """
+        forward_id = find_forward_id(message_data)
+        if not forward_id:
+            return ""
+        cached = self._cache.get(forward_id)
+        if cached:
+            self._cache.move_to_end(forward_id)
+            logger.debug("聊天记录 %s 命中指纹缓存", forward_id)
+            return cached
+
+        comp = next(c for c in message_data["message"] if isinstance(c, dict) and c.get("type") == "forward")
+        hasher = hashlib.sha256()
+        try:
+            # 逐节点喂给哈希，不拼接整份聊天记录
+            nodes = await self._expand(comp.get("data", {}), fetch)
+            if nodes is None:
+                return ""
+            await self._hash_nodes(hasher, nodes, fetch, 0, texts)
+        except Exception as e:
+            logger.warning("展开聊天记录 %s 失败: %s", forward_id, e)
+            return ""
+
+        fingerprint = hasher.hexdigest()
+        self._remember(forward_id, fingerprint)
+        return fingerprint
+
+    async def _expand(self, data: dict, fetch):
+        """取得转发段的节点列表：优先用消息自带的 content，否则调用 fetch"""
+        content = data.get("content")
+        if isinstance(content, list) and content:
+            return content
+        forward_id = str(data.get("id", "") or "")
+        if not forward_id or fetch is None:
+            return None
+        response = await fetch(forward_id)
+        if not isinstance(response, dict):
+            return None
+        return response.get("messages") or response.get("message") or []
+
+    async def _hash_nodes(self, hasher, nodes, fetch, depth, texts):
+        for node in nodes:
+            hasher.update(_NODE_SEP)
+            if not isinstance(node, dict):
+                hasher.update(str(node).encode("utf-8"))
+                continue
+            segments = node.get("message", node.get("content", node.get("raw_message", "")))
+            if isinstance(segments, str):
+                hasher.update(segments.encode("utf-8"))
+                if texts is not None:
+                    texts.append(segments)
+                continue
+            for seg in segments or []:
+                await self._hash_segment(hasher, seg, fetch, depth, texts)
+
+    async def _hash_segment(self, hasher, seg, fetch, depth, texts):
+        if not isinstance(seg, dict):
+            return
+        seg_type = seg.get("type", "")
+        data = seg.get("data", {}) or {}
+        hasher.update(_SEG_SEP)
+        if seg_type == "text":
+            text = data.get("text", "")
+            hasher.update(b"t:" + text.encode("utf-8"))
+            if texts is not None:
+                texts.append(text)
+        elif seg_type in ("image", "video", "record", "file"):
+            ident = _media_identity(data)
+            hasher.update(f"{seg_type[0]}:{ident}".encode("utf-8"))
+            if texts is not None:
+                texts.append(data.get("name") or ident)
+        elif seg_type == "face":
+            hasher.update(f"f:{data.get('id', '')}".encode("utf-8"))
+        elif seg_type == "forward":
+            # 嵌套转发：优先复用缓存的子指纹；需要收集文本时即使命中缓存也要展开，
+            # 否则套在新聊天记录里的已知广告会绕过关键词过滤
+            child_id = str(data.get("id", "") or "")
+            child = self._cache.get(child_id) if child_id else None
+            if (child is None or texts is not None) and depth + 1 < MAX_DEPTH:
+                child_hasher = hashlib.sha256()
+                nodes = await self._expand(data, fetch)
+                if nodes is not None:
+                    await self._hash_nodes(child_hasher, nodes, fetch, depth + 1, texts)
+                    if child is None:
+                        child = child_hasher.hexdigest()
+                        if child_id:
+                            self._remember(child_id, child)
+            hasher.update(f"F:{child or child_id}".encode("utf-8"))
+        elif seg_type in ("at", "reply"):
+            # @ 和回复与聊天记录内容无关
+            return
+        else:
+            hasher.update(f"{seg_type}:".encode("utf-8"))
@@ -3,27 +3,40 @@ from astrbot.api.event import AstrMessageEvent
 from typing import List, Dict, Union
 from astrbot.api import logger
 
+# OneBot 实现对已撤回/已过期消息返回的错误信息
+_MISSING_MESSAGE_HINTS = ("消息不存在", "message not found", "msg not found", "message not exist")
+
+
+def is_message_missing(error: Exception) -> bool:
+    """调用失败是否因为原消息已不存在（其余错误如超时、风控可能只是暂时的）"""
+    text = str(error).lower()
+    return any(hint in text for hint in _MISSING_MESSAGE_HINTS)
+
+
 class ForwardManager:
-    def __init__(self, event: AstrMessageEvent):
+    def __init__(self, event: AstrMessageEvent = None, call_action=None):
+        """call_action 为 OneBot 接口调用函数，不传时使用 event.bot.api.call_action
+
+        没有消息事件的场景（如补漏）直接传入 call_action。
+        """
         self.event = event
+        self.call_action = call_action or event.bot.api.call_action
     
     async def get_forward_msg(self, message_id: int = None):
         """获取转发消息"""
-        client = self.event.bot
         payloads = {
             "message_id": message_id or self.event.message_obj.message_id
         }
-        response = await client.api.call_action("get_forward_msg", **payloads)
+        response = await self.call_action("get_forward_msg", **payloads)
         return response
     
     async def send_forward_msg_raw(self, message_id: int, group_id: int):
         """发送转发消息"""
-        client = self.event.bot
         payloads = {
             "group_id": group_id,
             "message_id": message_id
         }
-        await client.api.call_action("forward_group_single_msg", **payloads)
+        await self.call_action("forward_group_single_msg", **payloads)
     
     async def build_base_node(self, msg_data: Dict) -> Dict:
         """构建基础节点"""
@@ -0,0 +1,97 @@
+# image_normalizer.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .log import get_logger
+
+logger = get_logger("image_normalizer", "ImageNormalizer")
+
+try:
+    from .image_worker import normalize_image
+except ImportError:
+    # 未安装 Pillow 时整个阶段关闭，原图照常发送
+    normalize_image = None
+
+
+class ImageNormalizer:
+    """图片规范化 - 发送前缩放并转码，按原图 MD5 缓存结果，同一张图只处理一次"""
+
+    def __init__(self, cache_dir: str = None, max_dimension: int = 2048, fmt: str = "jpeg",
+                 quality: int = 85, workers: int = 2):
+        self.cache_dir = cache_dir or "data/plugins_data/astrbot_plugin_fuckanka/temp/normalized"
+        self.max_dimension = max(0, max_dimension)
+        self.fmt = "webp" if str(fmt).lower() == "webp" else "jpeg"
+        self.ext = "webp" if self.fmt == "webp" else "jpg"
+        self.quality = min(max(quality, 1), 100)
+        self.workers = max(1, workers)
+        self.enabled = normalize_image is not None
+        self._pool = None
+        # 原图 MD5 -> 规范化结果路径；空字符串表示转码后没有变小，沿用原图
+        self._results = {}
+        self._inflight = {}
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        else:
+            logger.warning("未安装 Pillow，图片规范化已关闭")
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn 避免在多线程的主进程中 fork
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def normalize(self, path: str, md5: str) -> str:
+        """返回用于上传的图片路径，失败或无收益时返回原路径"""
+        if not self.enabled or not md5:
+            return path
+
+        cached = self._results.get(md5)
+        if cached is not None and (not cached or os.path.exists(cached)):
+            return cached or path
+
+        # 文件名带上转码参数，修改配置后不会误用旧结果
+        dst = os.path.join(self.cache_dir, f"{md5}_{self.max_dimension}_{self.quality}.{self.ext}")
+        if os.path.exists(dst):
+            self._results[md5] = dst
+            return dst
+
+        # 同一张图并发到达时只转码一次
+        future = self._inflight.get(md5)
+        if future is None:
+            future = asyncio.ensure_future(self._run(path, dst))
+            self._inflight[md5] = future
+            future.add_done_callback(lambda _: self._inflight.pop(md5, None))
+        try:
+            result = await asyncio.shield(future)
+        except Exception as e:
+            logger.warning("图片规范化失败，使用原图: %s (%s)", path, e)
+            return path
+        self._results[md5] = result
+        return result or path
+
+    async def _run(self, path: str, dst: str) -> str:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        changed = await loop.run_in_executor(
+            self._get_pool(), normalize_image, path, dst, self.max_dimension, self.fmt, self.quality
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        if not changed:
+            logger.debug("图片 %s 转码后未变小，沿用原图 (%.0f ms)", path, elapsed)
+            return ""
+        if logger.is_enabled_for(logging.DEBUG):
+            logger.debug(
+                "图片已规范化: %s -> %s, %s -> %s bytes (%.0f ms)",
+                path, dst, os.path.getsize(path), os.path.getsize(dst), elapsed,
+            )
+        return dst
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,55 @@
+# image_worker.py
+# 运行在子进程中的图片转码函数，只依赖 Pillow，保持子进程导入开销最小
+import os
+from PIL import Image, ImageSequence
+
+
+def _fit(img, max_dimension):
+    if max_dimension and max(img.size) > max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return img
+
+
+def _flatten(img):
+    """JPEG 不支持透明通道，透明部分铺白底"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return img.convert("RGB") if img.mode != "RGB" else img
+
+
+def normalize_image(src: str, dst: str, max_dimension: int, fmt: str, quality: int) -> bool:
+    """缩放并重新编码图片，写入 dst
+
+    结果不比原图小时不写入并返回 False，调用方继续使用原图。
+    动图仅在输出 webp 时逐帧转码，输出 jpeg 时保持原样。
+    """
+    tmp_path = f"{dst}.tmp"
+    with Image.open(src) as img:
+        animated = getattr(img, "is_animated", False)
+        if animated:
+            if fmt != "webp":
+                return False
+            frames, durations = [], []
+            for frame in ImageSequence.Iterator(img):
+                frames.append(_fit(frame.convert("RGBA"), max_dimension))
+                durations.append(frame.info.get("duration", 100))
+            frames[0].save(
+                tmp_path, "WEBP", save_all=True, append_images=frames[1:],
+                duration=durations, loop=img.info.get("loop", 0), quality=quality,
+            )
+        else:
+            img.load()
+            out = _fit(img.copy(), max_dimension)
+            if fmt == "webp":
+                out.save(tmp_path, "WEBP", quality=quality, method=4)
+            else:
+                _flatten(out).save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+
+    if os.path.getsize(tmp_path) >= os.path.getsize(src):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, dst)
+    return True
@@ -0,0 +1,152 @@
+# keyword_filter.py
+import asyncio
+import time
+from .log import get_logger
+
+logger = get_logger("keyword_filter", "KeywordFilter")
+
+try:
+    import ahocorasick
+except ImportError:
+    # 未安装 pyahocorasick 时使用纯 Python 实现
+    ahocorasick = None
+
+# 多段文本拼接时的分隔符，归一化后的关键词中不会出现，避免跨段误匹配
+_SEP = "\x00"
+
+
+def normalize(text: str) -> str:
+    """大小写折叠并去掉所有空白，"加 V  X" 与 "加vx" 视为相同"""
+    return "".join(str(text).casefold().split())
+
+
+class AhoCorasick:
+    """纯 Python 的 Aho-Corasick 自动机，一次线性扫描匹配全部关键词"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [-1]  # 以该状态结尾（含失配链上）的任一关键词下标，-1 表示无
+        for i, pattern in enumerate(self.patterns):
+            self._insert(pattern, i)
+        self._link()
+
+    def _insert(self, pattern, index):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(-1)
+                self._goto[state][ch] = nxt
+            state = nxt
+        if self._out[state] < 0:
+            self._out[state] = index
+
+    def _link(self):
+        """按层次遍历建立失配指针，并沿失配链合并输出"""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if out[nxt] < 0:
+                    out[nxt] = out[fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text: str) -> str:
+        """返回 text 中第一个命中的关键词，没有命中返回空字符串"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] >= 0:
+                return self.patterns[out[state]]
+        return ""
+
+
+class _NativeMatcher:
+    """pyahocorasick 封装，接口与 AhoCorasick 相同"""
+
+    def __init__(self, patterns):
+        self._automaton = ahocorasick.Automaton()
+        for pattern in patterns:
+            self._automaton.add_word(pattern, pattern)
+        self._automaton.make_automaton()
+
+    def find(self, text: str) -> str:
+        for _, pattern in self._automaton.iter(text):
+            return pattern
+        return ""
+
+
+def _build(patterns):
+    return _NativeMatcher(patterns) if ahocorasick is not None else AhoCorasick(patterns)
+
+
+class KeywordFilter:
+    """关键词/广告过滤 - 关键词列表变化时在线程中重建自动机，建好后整体替换
+
+    重建期间继续使用旧自动机，匹配不会被阻塞。
+    """
+
+    def __init__(self):
+        self._matcher = None
+        self._keywords = ()
+        # 最近一次请求的关键词列表（可能仍在构建中），判断是否需要重建以它为准
+        self._requested = ()
+        self._originals = {}
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._keywords)
+
+    async def update(self, keywords):
+        """更新关键词列表，列表未变化时不重建"""
+        originals = {}
+        for keyword in keywords or []:
+            key = normalize(keyword)
+            if key:
+                originals.setdefault(key, str(keyword))
+        normalized = tuple(sorted(originals))
+        if normalized == self._requested:
+            return
+        self._requested = normalized
+
+        self._generation += 1
+        generation = self._generation
+        start = time.perf_counter()
+        matcher = await asyncio.to_thread(_build, normalized) if normalized else None
+        # 重建期间列表又变了，交给更新的那次重建
+        if generation != self._generation:
+            return
+        self._matcher = matcher
+        self._keywords = normalized
+        self._originals = originals
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(
+            "关键词自动机已重建: %s 个关键词，%s，耗时 %.1f ms",
+            len(normalized), "pyahocorasick" if ahocorasick is not None else "纯 Python", elapsed,
+        )
+
+    def match(self, texts) -> str:
+        """在多段文本中查找关键词，返回命中的关键词（配置中的原文），未命中返回空字符串"""
+        matcher = self._matcher
+        if matcher is None:
+            return ""
+        text = _SEP.join(normalize(t) for t in texts if t)
+        if not text:
+            return ""
+        hit = matcher.find(text)
+        return self._originals.get(hit, hit) if hit else ""
@@ -1,5 +1,7 @@
 # listen.py
-from astrbot.api import logger
+from .log import get_logger
+
+logger = get_logger("listen", "Listen")
 
 async def parse_message_components(components, level=0):
     """
@@ -8,25 +10,25 @@ async def parse_message_components(components, level=0):
     """
     all_components = []
     indent = "  " * level
-    
+
     for i, comp in enumerate(components):
         comp_type = comp.get("type", "unknown").lower()
         data = comp.get("data", {})
         url = data.get("url", "")
 
-        logger.info(f"{indent}- 组件{i} 原始值: {comp}")
+        # 原始值只在 DEBUG 下格式化，%r 延迟到确认输出时才求值
+        logger.debug("%s- 组件%d 原始值: %r", indent, i, comp)
 
         if comp_type in ["plain", "text"]:
-            text = data.get("text")
-            logger.info(f"{indent}- 组件{i}: 类型=文本 | 内容={text}")
+            logger.debug("%s- 组件%d: 类型=文本 | 内容=%s", indent, i, data.get("text"))
             all_components.append(comp)
-            
+
         elif comp_type in ["image", "video"]:
-            logger.info(f"{indent}- 组件{i}: 类型={comp_type} | URL={url}")
+            logger.debug("%s- 组件%d: 类型=%s | URL=%s", indent, i, comp_type, url)
             all_components.append(comp)
-            
+
         else:
-            logger.info(f"{indent}- 组件{i}: 类型={comp_type} | 详细数据={comp}")
+            logger.debug("%s- 组件%d: 类型=%s | 详细数据=%r", indent, i, comp_type, comp)
             # 忽略其他类型消息
-    
-    return all_components
\ No newline at end of file
+
+    return all_components
@@ -1,39 +1,118 @@
 # local_cache.py
+import asyncio
 import os
 import json
 import re
+import time
 import aiofiles
-from astrbot.api import logger
+from .cache_index import CacheIndex
+from .dedup_store import MemoryDedupStore
+from .fingerprint import ForwardFingerprinter
+from .log import get_logger
+from .snapshot import dump_in_background, dump_json, encode_json, load_json
+
+logger = get_logger("local_cache", "LocalCache")
+
+# 缓存索引变化后延迟多久保存（秒），期间的多次增删合并为一次写入
+_INDEX_SAVE_DELAY = 5.0
 
 class LocalCache:
-    def __init__(self, cache_dir="data/plugins_data/astrbot_plugin_fuckanka/temp/shit"):
+    def __init__(self, cache_dir="data/plugins_data/astrbot_plugin_fuckanka/temp/shit", store=None):
         self.cache_dir = cache_dir
+        # 去重判断走 store：内存中只有布隆过滤器，精确记录在磁盘上
+        self.store = store or MemoryDedupStore()
+        # 旧版本的首尾记录，启动时导入 store 后改名，不再写入
         self.config_path = os.path.join(cache_dir, "forward_config.json")
+        self.index_path = os.path.join(cache_dir, "cache_index.json")
         os.makedirs(cache_dir, exist_ok=True)
+        # 聊天记录按全部节点内容计算指纹，指纹按转发 id 缓存
+        self.fingerprinter = ForwardFingerprinter(os.path.join(cache_dir, "forward_fingerprint.json"))
         
-        # 初始化配置
-        self.forward_config = self._load_config()
+        # 去重状态在后台加载，加载完成前的去重请求需等待 ready
+        self.index = CacheIndex()
+        self._index_dirty = False
+        self._index_task = None
+        self.ready = asyncio.Event()
+        asyncio.create_task(self._async_init())
+
+    async def _async_init(self):
+        """异步初始化"""
+        start = time.perf_counter()
+        try:
+            await self.store.warm_up()
+            await asyncio.to_thread(self._migrate_config)
+            await asyncio.to_thread(self.fingerprinter.load)
+            self.index = await asyncio.to_thread(self._load_index)
+        finally:
+            self.ready.set()
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info("已加载 %s 条缓存索引，去重状态已就绪，耗时 %.1f ms", len(self.index), elapsed)
+
+    async def wait_ready(self):
+        """等待去重状态加载完成"""
+        await self.ready.wait()
+
+    def close(self):
+        """保存指纹缓存和尚未落盘的缓存索引"""
+        self.fingerprinter.save()
+        if self._index_task is not None:
+            self._index_task.cancel()
+        if self._index_dirty:
+            try:
+                dump_json(self.index_path, self.index.to_dict())
+                self._index_dirty = False
+            except Exception as e:
+                logger.error("保存缓存索引失败: %s", e)
     
-    def _load_config(self):
-        """加载转发配置"""
+    def _migrate_config(self):
+        """把旧版 forward_config.json 的首尾记录导入 store"""
         try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            config = load_json(self.config_path)
+            if config is None:
+                return
+            keys = [self._dedup_key(c.get("title", ""), c.get("button", "")) for c in config.values()]
+            self.store.add_many("forward", [k for k in keys if k])
+            if self.store.persistent:
+                os.replace(self.config_path, f"{self.config_path}.migrated")
+            logger.info("已从 forward_config.json 导入 %s 条转发记录", len(config))
         except Exception as e:
-            logger.error(f"[LocalCache] 加载配置失败: {e}")
-        return {}
+            logger.error("导入转发配置失败: %s", e)
     
-    def _save_config(self):
-        """保存转发配置"""
+    def _load_index(self):
+        """加载缓存索引，没有索引快照时扫描一次缓存目录重建"""
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.forward_config, f, ensure_ascii=False, indent=2)
-            return True
+            data = load_json(self.index_path)
+            if data is not None:
+                return CacheIndex.from_dict(data)
         except Exception as e:
-            logger.error(f"[LocalCache] 保存配置失败: {e}")
-            return False
-    
+            logger.error("加载缓存索引失败: %s", e)
+
+        index = CacheIndex()
+        for filename in os.listdir(self.cache_dir):
+            msg_id = filename[:-len(".json")]
+            if filename.endswith(".json") and msg_id.isdigit():
+                index.add(msg_id, "forward")
+        return index
+
+    def _index_changed(self):
+        """缓存索引有变化，延迟保存；插件卸载时由 close 保存剩余的变化"""
+        self._index_dirty = True
+        if self._index_task is None or self._index_task.done():
+            self._index_task = asyncio.create_task(self._save_index_later())
+
+    async def _save_index_later(self):
+        await asyncio.sleep(_INDEX_SAVE_DELAY)
+        self._index_dirty = False
+        # 在事件循环中导出，写文件交给线程，失败时由 dump_in_background 记录日志
+        dump_in_background(self.index_path, encode_json(self.index.to_dict()))
+
+    def pick_random(self, weights=None, exclude=None):
+        """O(1) 随机抽取一条缓存消息，返回 (msg_id, kind)，缓存为空时返回 (None, None)"""
+        msg_id = self.index.sample(weights, exclude)
+        if msg_id is None:
+            return None, None
+        return msg_id, self.index.kind_of(msg_id)
+
     def _get_cache_path(self, msg_id):
         return os.path.join(self.cache_dir, f"{msg_id}.json")
     
@@ -43,19 +122,17 @@ class LocalCache:
             return False
         return text.isdigit()
     
-    def _compare_values(self, value1, value2):
-        """比较两个值，如果是数字则进行数值比较，否则进行字符串比较"""
-        if not value1 or not value2:
-            return False
-            
-        if self._is_pure_number(value1) and self._is_pure_number(value2):
-            # 数值比较
-            num1 = int(value1)
-            num2 = int(value2)
-            return num1 == num2
-        else:
-            # 字符串比较
-            return value1 == value2
+    def _normalize_value(self, value):
+        """纯数字按数值归一（"007" 与 "7" 视为相同），其余保持原样"""
+        if self._is_pure_number(value):
+            return str(int(value))
+        return value
+
+    def _dedup_key(self, title, button):
+        """由首尾内容生成去重键，任一为空时返回空字符串（不参与去重）"""
+        if not title or not button:
+            return ""
+        return f"{self._normalize_value(title)}\x1f{self._normalize_value(button)}"
     
     def _extract_content_info(self, message_data):
         """提取消息的首尾内容"""
@@ -174,95 +251,106 @@ class LocalCache:
             # 文本消息，直接返回
             return raw_message
     
-    async def add_cache(self, msg_id, message_data=None):
-        """缓存消息到本地，并记录首尾内容"""
+    async def _write_cache(self, msg_id, message_data, kind):
+        """写入缓存文件并加入索引"""
         cache_path = self._get_cache_path(msg_id)
+        async with aiofiles.open(cache_path, 'w', encoding='utf-8') as f:
+            if message_data:
+                await f.write(json.dumps(message_data, ensure_ascii=False, indent=2))
+            else:
+                await f.write('')
+        logger.debug("消息 %s 已缓存", msg_id)
+        self.index.add(msg_id, kind)
+        self._index_changed()
+
+    async def add_cache(self, msg_id, message_data=None, kind="forward"):
+        """缓存消息到本地，并记录首尾内容
+
+        kind 为 "forward"（聊天记录）或 "media"（图文/视频消息），仅聊天记录参与首尾去重。
+        """
+        await self.wait_ready()
         try:
-            async with aiofiles.open(cache_path, 'w', encoding='utf-8') as f:
-                if message_data:
-                    await f.write(json.dumps(message_data, ensure_ascii=False, indent=2))
-                else:
-                    await f.write('')
-            logger.info(f"[LocalCache] 消息 {msg_id} 已缓存")
+            await self._write_cache(msg_id, message_data, kind)
             
-            # 记录首尾内容到配置
-            if message_data:
-                title, button = self._extract_content_info(message_data)
-                # 先检查是否重复，再添加到配置
-                if not self._is_duplicate_in_config(title, button):
-                    self.forward_config[str(msg_id)] = {
-                        "title": title,  # 不限制长度
-                        "button": button  # 不限制长度
-                    }
-                    self._save_config()
-                    logger.info(f"[LocalCache] 消息 {msg_id} 内容已记录: title='{title}', button='{button}'")
-                else:
-                    logger.info(f"[LocalCache] 消息 {msg_id} 内容重复，不记录到配置")
+            # 记录聊天记录的去重键
+            if message_data and kind == "forward":
+                # 先检查是否重复，再写入去重存储
+                key = self._cached_forward_key(message_data)
+                if key and not await self.store.check_and_add("forward", key):
+                    logger.info("消息 %s 内容已记录: %s", msg_id, key)
+                elif key:
+                    logger.info("消息 %s 内容重复，不记录到去重存储", msg_id)
             
             return True
         except Exception as e:
-            logger.error(f"[LocalCache] 缓存消息失败: {e}")
+            logger.error("缓存消息失败: %s", e)
             return False
-    
-    def _is_duplicate_in_config(self, title, button):
-        """检查配置中是否已存在相同的title和button"""
-        if not title or not button:
+
+    async def forward_key(self, message_data, fetch=None, texts=None):
+        """转发消息的去重键，无法判重时返回空字符串
+
+        优先使用全部节点内容的指纹（fetch 为 get_forward_msg，用于展开聊天记录）；
+        展开失败时退回首尾内容。传入 texts 时收集展开出的文本和文件名。
+        """
+        fingerprint = await self.fingerprinter.fingerprint(message_data, fetch, texts)
+        if fingerprint:
+            return f"fp:{fingerprint}"
+        return self._dedup_key(*self._extract_content_info(message_data))
+
+    def _cached_forward_key(self, message_data):
+        """不展开聊天记录的去重键：指纹缓存命中时用指纹，否则用首尾内容"""
+        fingerprint = self.fingerprinter.lookup(message_data)
+        if fingerprint:
+            return f"fp:{fingerprint}"
+        return self._dedup_key(*self._extract_content_info(message_data))
+
+    async def claim_forward(self, msg_id, message_data, key=None):
+        """原子地占用转发消息的去重键并缓存消息
+
+        返回 True 表示由本次调用负责转发；去重键已存在（包括其他 bot 进程刚写入）时返回 False。
+        """
+        await self.wait_ready()
+        if key is None:
+            key = await self.forward_key(message_data)
+        if key and await self.store.check_and_add("forward", key):
             return False
-        
-        for config in self.forward_config.values():
-            config_title = config.get("title", "")
-            config_button = config.get("button", "")
-            
-            # 使用智能比较（数字比较或字符串比较）
-            title_match = self._compare_values(config_title, title)
-            button_match = self._compare_values(config_button, button)
-            
-            if title_match and button_match:
-                logger.info(f"[LocalCache] 发现重复内容: title='{title}'='{config_title}', button='{button}'='{config_button}'")
-                return True
-        
-        return False
+        try:
+            await self._write_cache(msg_id, message_data, "forward")
+        except Exception as e:
+            logger.error("缓存消息失败: %s", e)
+        return True
     
-    def is_duplicate_forward(self, message_data):
-        """检查是否为重复的转发消息"""
+    async def is_duplicate_forward(self, message_data, key=None):
+        """检查是否为重复的转发消息，key 为 forward_key 的结果"""
         try:
-            title, button = self._extract_content_info(message_data)
-            logger.info(f"[LocalCache] 检查重复: title='{title}', button='{button}'")
+            if key is None:
+                key = self._cached_forward_key(message_data)
+            logger.debug("检查重复: %s", key)
             
-            # 如果title或button为空，不认为是重复
-            if not title or not button:
-                logger.info(f"[LocalCache] title或button为空，不进行重复检查")
+            # 无法判重时不认为是重复
+            if not key:
+                logger.debug("去重键为空，不进行重复检查")
                 return False
             
-            # 检查配置中是否已存在
-            is_duplicate = self._is_duplicate_in_config(title, button)
+            # 检查去重存储中是否已存在
+            is_duplicate = await self.store.contains("forward", key)
             if is_duplicate:
-                logger.info(f"[LocalCache] 发现重复转发消息")
+                logger.debug("发现重复转发消息")
             else:
-                logger.info(f"[LocalCache] 未发现重复消息")
+                logger.debug("未发现重复消息")
             
             return is_duplicate
         except Exception as e:
-            logger.error(f"[LocalCache] 检查重复转发失败: {e}")
+            logger.error("检查重复转发失败: %s", e)
             return False
     
     async def get_waiting_messages(self):
         """获取所有等待转发的消息ID"""
+        await self.wait_ready()
         try:
-            if not os.path.exists(self.cache_dir):
-                return []
-            
-            messages = []
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json') and filename != "forward_config.json":
-                    try:
-                        msg_id = int(filename.split('.')[0])
-                        messages.append(msg_id)
-                    except ValueError:
-                        continue
-            return messages
+            return [int(msg_id) for msg_id in self.index.ids()]
         except Exception as e:
-            logger.error(f"[LocalCache] 获取等待消息失败: {e}")
+            logger.error("获取等待消息失败: %s", e)
             return []
     
     async def get_message_data(self, msg_id):
@@ -276,22 +364,24 @@ class LocalCache:
                         return json.loads(content)
             return None
         except Exception as e:
-            logger.error(f"[LocalCache] 获取消息数据失败: {e}")
+            logger.error("获取消息数据失败: %s", e)
             return None
     
     async def remove_cache(self, msg_id):
-        """移除缓存的消息"""
+        """移除缓存的消息
+
+        只移除缓存文件和索引条目；去重键保留在存储中，共享存储上的其他 bot 进程仍依赖它判重。
+        """
+        await self.wait_ready()
         cache_path = self._get_cache_path(msg_id)
         try:
+            if self.index.remove(msg_id):
+                self._index_changed()
             if os.path.exists(cache_path):
                 os.remove(cache_path)
-                # 从配置中移除
-                if str(msg_id) in self.forward_config:
-                    del self.forward_config[str(msg_id)]
-                    self._save_config()
-                logger.info(f"[LocalCache] 消息 {msg_id} 已移除")
+                logger.info("消息 %s 已移除", msg_id)
                 return True
             return False
         except Exception as e:
-            logger.error(f"[LocalCache] 移除消息失败: {e}")
+            logger.error("移除消息失败: %s", e)
             return False
@@ -0,0 +1,108 @@
+# log.py
+import contextvars
+import logging
+import time
+import uuid
+from astrbot.api import logger as base_logger
+
+LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
+# 当前消息的追踪 ID，asyncio.create_task 会复制上下文，子任务自动继承
+_trace_id = contextvars.ContextVar("fuckanka_trace_id", default="")
+
+
+class _Settings:
+    default_level = logging.INFO
+    module_levels = {}
+    sample_interval = 60.0
+
+
+def _parse_level(value, default):
+    return LEVELS.get(str(value).strip().upper(), default)
+
+
+def configure(config: dict):
+    """从插件配置读取日志设置，可重复调用以热更新"""
+    _Settings.default_level = _parse_level(config.get("log_level", "INFO"), logging.INFO)
+    module_levels = {}
+    for item in config.get("log_module_levels", []) or []:
+        name, sep, level = str(item).partition("=")
+        if sep and name.strip():
+            module_levels[name.strip()] = _parse_level(level, _Settings.default_level)
+    _Settings.module_levels = module_levels
+    _Settings.sample_interval = max(0.0, float(config.get("log_sample_interval", 60)))
+
+
+def new_trace_id() -> str:
+    """为当前消息生成追踪 ID"""
+    trace_id = uuid.uuid4().hex[:8]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def get_trace_id() -> str:
+    return _trace_id.get()
+
+
+class PluginLogger:
+    """插件日志 - 按模块分级、%-格式延迟求值，重复日志可按时间窗口采样"""
+
+    def __init__(self, module: str, tag: str):
+        self.module = module
+        self.tag = f"[{tag}]"
+        self._samples = {}  # key -> [上次输出时间, 期间被省略的条数]
+
+    def is_enabled_for(self, level: int) -> bool:
+        threshold = _Settings.module_levels.get(self.module, _Settings.default_level)
+        return level >= threshold and base_logger.isEnabledFor(level)
+
+    def _emit(self, level, msg, args, suffix=""):
+        text = msg % args if args else msg
+        trace_id = _trace_id.get()
+        prefix = f"{self.tag}[{trace_id}]" if trace_id else self.tag
+        base_logger.log(level, f"{prefix} {text}{suffix}")
+
+    def log(self, level, msg, *args):
+        if self.is_enabled_for(level):
+            self._emit(level, msg, args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
+
+    def sampled(self, level, key, msg, *args):
+        """同一 key 在采样窗口内只输出一次，下次输出时附带被省略的条数"""
+        if not self.is_enabled_for(level):
+            return
+        now = time.monotonic()
+        entry = self._samples.get(key)
+        if entry is not None and now - entry[0] < _Settings.sample_interval:
+            entry[1] += 1
+            return
+        suppressed = entry[1] if entry else 0
+        self._samples[key] = [now, 0]
+        suffix = f"（期间省略 {suppressed} 条同类日志）" if suppressed else ""
+        self._emit(level, msg, args, suffix)
+
+
+_loggers = {}
+
+
+def get_logger(module: str, tag: str = None) -> PluginLogger:
+    """获取模块日志对象，module 用于按模块配置级别，tag 为日志前缀"""
+    if module not in _loggers:
+        _loggers[module] = PluginLogger(module, tag or module)
+    return _loggers[module]
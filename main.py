@@ -1,16 +1,28 @@
 import asyncio
+import logging
 import time
 import datetime
-from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, filter
 from astrbot.api.star import Context, Star, register
 from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
 from .listen import parse_message_components
 from .download import MediaDownloader
-from .forward_manager import ForwardManager
+from .forward_manager import ForwardManager, is_message_missing
 from .local_cache import LocalCache
 from .sender import MessageSender
 from .cleaner import AsyncDailyCleaner
+from .cache_index import RecentWindow
+from .dedup_store import create_dedup_store
+from .image_normalizer import ImageNormalizer
+from .singleflight import SingleFlight
+from .filter_config import ConfigReloader
+from .keyword_filter import KeywordFilter
+from .backfill import Backfiller, message_key
+from .scheduler import LaneScheduler
+from .profiler import LoopLagProbe, SamplingProfiler
+from .log import configure as configure_logging, get_logger, new_trace_id
+
+logger = get_logger("main", "MediaMonitor")
 
 @register(
     "fuckanka",
@@ -21,27 +33,133 @@ from .cleaner import AsyncDailyCleaner
 class MediaMonitorPlugin(Star):
     def __init__(self, context: Context, config=None):
         super().__init__(context)
-        self.downloader = MediaDownloader()
         self.config = config or {}
+        configure_logging(self.config)
+        self.dedup_store = create_dedup_store(self.config)
+        mb = 1024 * 1024
+        self.downloader = MediaDownloader(
+            size_limits={
+                "image": int(self.config.get("max_image_size_mb", 20)) * mb,
+                "video": int(self.config.get("max_video_size_mb", 200)) * mb,
+                "record": int(self.config.get("max_record_size_mb", 20)) * mb,
+            },
+            store=self.dedup_store,
+            head_bytes=int(self.config.get("head_dedup_kb", 64)) * 1024,
+        )
 
-        # 黑名单用户列表
-        self.blacklist_users = self.config.get("blacklist_users", [])
-        
-        self.monitored_groups = [str(gid) for gid in self.config.get("monitored_groups", [])]
-        self.target_groups = [str(gid) for gid in self.config.get("target_groups", [])]
+        # 监听群、目标群、黑名单和短文本阈值预编译为只读对象，配置文件变化时整体替换
+        self.reloader = ConfigReloader(
+            self.config, float(self.config.get("config_reload_interval", 5)), on_reload=self._apply_config
+        )
 
         temp_dir = "data/plugins_data/astrbot_plugin_fuckanka/temp"
         cleaner = AsyncDailyCleaner(temp_dir)
         # 启动缓存清理任务
         asyncio.create_task(cleaner.run_daily_task())
 
-        self.local_cache = LocalCache()
-        self.sender = MessageSender(context, self.target_groups)
+        self.local_cache = LocalCache(store=self.dedup_store)
+        self.image_normalizer = None
+        if self.config.get("image_normalize", False):
+            self.image_normalizer = ImageNormalizer(
+                max_dimension=int(self.config.get("image_max_dimension", 2048)),
+                fmt=self.config.get("image_format", "jpeg"),
+                quality=int(self.config.get("image_quality", 85)),
+            )
+        self.sender = MessageSender(
+            context, self.filters.target_groups, md5_lookup=self.downloader.get_file_md5, store=self.dedup_store,
+            normalizer=self.image_normalizer,
+        )
         self.message_cache = {}
-        logger.info(f"[MediaMonitor] 插件已加载, 监听群: {self.monitored_groups}, 目标群: {self.target_groups}")
+        self.flight = SingleFlight()
+        # 轻量通道：服务端转发和纯文本；重通道：需要下载上传媒体的消息
+        self.scheduler = LaneScheduler(
+            {
+                "light": (float(self.config.get("light_lane_weight", 3)), int(self.config.get("light_lane_concurrency", 4))),
+                "heavy": (float(self.config.get("heavy_lane_weight", 1)), int(self.config.get("heavy_lane_concurrency", 2))),
+            },
+            max_concurrency=int(self.config.get("max_concurrency", 4)),
+        )
+        # 广告/违禁词过滤，自动机在后台线程中构建，构建完成前不过滤
+        self.keyword_filter = KeywordFilter()
+        asyncio.create_task(self.keyword_filter.update(self.config.get("blocked_keywords", [])))
+
+        # 补漏：收到第一条消息（OneBot 连接可用）后取回停机期间的历史消息
+        self.backfiller = Backfiller(
+            "data/plugins_data/astrbot_plugin_fuckanka/backfill_state.json",
+            self.dedup_store,
+            max_messages=int(self.config.get("backfill_max_messages", 200)),
+            rate=float(self.config.get("backfill_rate", 1.0)),
+        )
+        self._call_action = None
+        self._connected = asyncio.Event()
+        asyncio.create_task(self._run_startup_backfill())
+
+        # 随机搬运：按类型加权，每个群记住最近抽过的若干条避免重复
+        self.random_weights = self._random_weights(self.config)
+        self.recent_picks = RecentWindow(int(self.config.get("random_no_repeat_window", 20)))
+        # 常驻的事件循环卡顿探测，和按需启动的采样分析
+        self.lag_probe = LoopLagProbe(threshold=float(self.config.get("loop_lag_threshold_ms", 200)) / 1000)
+        self.lag_probe.start()
+        self.profiler = SamplingProfiler()
+        logger.info(
+            "插件已加载, 监听群: %s, 目标群: %s", sorted(self.filters.monitored_groups), list(self.filters.target_groups)
+        )
         
         # 启动缓存清理任务
         asyncio.create_task(self._run_cache_cleaner())
+        asyncio.create_task(self.reloader.run())
+
+    @property
+    def filters(self):
+        """当前生效的过滤配置"""
+        return self.reloader.current
+
+    @staticmethod
+    def _random_weights(config):
+        return {
+            "forward": float(config.get("random_forward_weight", 1.0)),
+            "media": float(config.get("random_media_weight", 1.0)),
+        }
+
+    def _apply_config(self, config):
+        """热重载时同步更新日志级别、随机搬运权重，并在后台重建关键词自动机"""
+        configure_logging(config)
+        self.random_weights = self._random_weights(config)
+        asyncio.create_task(self.keyword_filter.update(config.get("blocked_keywords", [])))
+
+    async def terminate(self):
+        """插件卸载时停止卡顿探测，保存指纹缓存和补漏水位，关闭去重存储和图片转码进程池"""
+        self.lag_probe.stop()
+        self.local_cache.close()
+        self.backfiller.save()
+        self.dedup_store.close()
+        if self.image_normalizer:
+            self.image_normalizer.shutdown()
+
+    async def _run_startup_backfill(self):
+        """加载水位，等 OneBot 连接可用后补漏一次"""
+        await asyncio.to_thread(self.backfiller.load)
+        if self.backfiller.max_messages == 0:
+            return
+        await self._connected.wait()
+        await self.local_cache.wait_ready()
+        fed = await self._backfill(self._call_action)
+        logger.info("启动补漏完成，送入流水线 %s 条消息", fed)
+
+    async def _backfill(self, call_action):
+        rules = self.filters
+        groups = sorted(rules.monitored_groups) if rules.monitored_groups else self.backfiller.groups()
+        forward_manager = ForwardManager(call_action=call_action)
+
+        async def handle(group_id, message):
+            new_trace_id()
+            rules = self.filters
+            if not rules.is_monitored(group_id):
+                return
+            logger.debug("补漏消息 - 群: %s, 消息ID: %s", group_id, message.get("message_id"))
+            await self.dispatch_message(message, message.get("message_id"), group_id, rules, forward_manager)
+
+        return await self.backfiller.run(call_action, groups, handle)
 
     async def _run_cache_cleaner(self):
         """定时清理 message_cache"""
@@ -54,11 +172,13 @@ class MediaMonitorPlugin(Star):
                 next_run += datetime.timedelta(days=1)
             sleep_seconds = (next_run - now).total_seconds()
 
-            logger.info(f"[MediaMonitor] 缓存清理任务将在 {sleep_seconds:.0f} 秒后执行（东八区时间 {next_run})")
+            logger.info("缓存清理任务将在 %.0f 秒后执行（东八区时间 %s)", sleep_seconds, next_run)
             await asyncio.sleep(sleep_seconds)
 
             # 执行清理
             self._clean_message_cache()
+            # 丢弃滑出去重窗口的日桶
+            await self.dedup_store.expire()
 
     def _clean_message_cache(self):
         """清理 message_cache 中已处理或超时的消息"""
@@ -73,29 +193,32 @@ class MediaMonitorPlugin(Star):
         for msg_id in to_delete:
             del self.message_cache[msg_id]
 
-        logger.info(f"[MediaMonitor] 已清理 {len(to_delete)} 条缓存消息")
+        logger.info("已清理 %s 条缓存消息", len(to_delete))
 
-    async def process_ordinary_message(self, message_data: dict, msg_id: int):
-        """处理普通消息（文本+媒体）"""
+    async def process_ordinary_message(self, message_data: dict, msg_id: int, group_id: str, rules=None):
+        """处理普通消息（文本+媒体），返回是否需要继续下载转发"""
         if "message" not in message_data:
-            return
+            return False
+        rules = rules or self.filters
 
         # 获取用户 ID
         sender_id = str(message_data.get("sender", {}).get("user_id", ""))
         
         # 1. 检查用户是否在黑名单中
-        if sender_id in self.blacklist_users:
-            logger.info(f"[MediaMonitor] 用户 {sender_id} 在黑名单中，跳过消息 {msg_id}")
-            return
+        if rules.is_blacklisted(sender_id):
+            logger.sampled(logging.INFO, "blacklist", "用户 %s 在黑名单中，跳过消息 %s", sender_id, msg_id)
+            return False
         
         components = await parse_message_components(message_data["message"])
         
         self.message_cache[msg_id] = {
+            "raw": message_data,
             "components": components,
             "text_content": "",
             "media_files": [],
             "processed": False,
             "is_forward": False,
+            "target_groups": rules.targets_for(group_id),
             "timestamp": time.time()  # 添加时间戳
         }
         
@@ -119,12 +242,24 @@ class MediaMonitorPlugin(Star):
         
         self.message_cache[msg_id]["text_content"] = "\n".join(text_parts)
         self.message_cache[msg_id]["media_files"] = media_list
-        logger.info(f"[MediaMonitor] 普通消息 {msg_id} 解析完成: {len(text_parts)}文本, {len(media_list)}媒体")
+        logger.debug("普通消息 %s 解析完成: %s文本, %s媒体", msg_id, len(text_parts), len(media_list))
         
-        # 2. 检查消息内容是否为单一文本且文本长度小于10个字符
-        if len(text_parts) == 1 and len(text_parts[0]) < 10:
-            logger.info(f"[MediaMonitor] 消息 {msg_id} 为单文本且长度小于 10 个字符，跳过处理")
-            return
+        # 2. 文本和媒体文件名中含有屏蔽关键词时跳过
+        hit = self.keyword_filter.match(text_parts + [m["data"].get("file", "") for m in media_list])
+        if hit:
+            logger.sampled(logging.INFO, "keyword", "消息 %s 命中屏蔽关键词 '%s'，跳过处理", msg_id, hit)
+            del self.message_cache[msg_id]
+            return False
+
+        # 3. 检查消息内容是否为单一文本且文本长度小于阈值
+        if rules.is_short_text(group_id, text_parts, media_list):
+            logger.sampled(
+                logging.INFO, "short_text", "消息 %s 为纯文本且长度小于 %s 个字符，跳过处理",
+                msg_id, rules.rule_for(group_id).min_text_length,
+            )
+            del self.message_cache[msg_id]
+            return False
+        return True
 
     async def download_and_forward_ordinary_message(self, msg_id: int):
         """下载普通消息的媒体文件并通过sender发送"""
@@ -136,63 +271,103 @@ class MediaMonitorPlugin(Star):
             return
         
         if message_info["text_content"] or message_info["media_files"]:
-            logger.info(f"[MediaMonitor] 转发普通消息 {msg_id}")
-            
-            image_paths = []
-            video_path = None
-            
-            for media_info in message_info["media_files"]:
-                logger.info(f"[MediaMonitor] 开始下载媒体: {media_info['type']}")
-                result = await self.downloader.download_media(media_info)
-                if result:
-                    if media_info["type"] == "image":
-                        image_paths.append(result)
-                        logger.info(f"[MediaMonitor] 图片下载成功: {result}")
-                    elif media_info["type"] == "video" and video_path is None:
-                        video_path = result
-                        logger.info(f"[MediaMonitor] 视频下载成功: {result}")
-                    elif media_info["type"] == "record":
-                        logger.info(f"[MediaMonitor] 语音消息下载成功: {result}")
-            
-            # ✅ 调用 sender 发送
-            if video_path:
-                await self.sender.send_combined_message(
-                    text=message_info["text_content"],
-                    image_paths=image_paths,
-                    video_path=video_path
-                )
-            elif image_paths:
-                await self.sender.send_combined_message(
-                    text=message_info["text_content"],
-                    image_paths=image_paths
-                )
-            else:
-                await self.sender.send_text_message(message_info["text_content"])
+            # 内容相同的普通消息并发到达时只处理一次，其余任务等待后跳过
+            key = (
+                "ordinary",
+                message_info["text_content"],
+                tuple(self.downloader.media_identity(m) for m in message_info["media_files"]),
+            )
+            _, shared = await self.flight.do(key, lambda: self._forward_ordinary(msg_id, message_info))
+            if shared:
+                logger.info("普通消息 %s 与进行中的转发内容相同，跳过", msg_id)
         
         message_info["processed"] = True
 
-    async def process_forward_message(self, event: AstrMessageEvent, message_data: dict, msg_id: int):
+    async def _forward_ordinary(self, msg_id: int, message_info: dict):
+        """下载媒体并发送一条普通消息"""
+        logger.info("转发普通消息 %s", msg_id)
+        
+        image_paths = []
+        video_path = None
+        
+        for media_info in message_info["media_files"]:
+            logger.debug("开始下载媒体: %s", media_info['type'])
+            result = await self.downloader.download_media(media_info)
+            if result:
+                if media_info["type"] == "image":
+                    image_paths.append(result)
+                    logger.debug("图片下载成功: %s", result)
+                elif media_info["type"] == "video" and video_path is None:
+                    video_path = result
+                    logger.debug("视频下载成功: %s", result)
+                elif media_info["type"] == "record":
+                    logger.debug("语音消息下载成功: %s", result)
+        
+        # ✅ 调用 sender 发送，目标群在收到消息时按来源群确定
+        target_groups = message_info["target_groups"]
+        if video_path:
+            sent = await self.sender.send_combined_message(
+                text=message_info["text_content"],
+                image_paths=image_paths,
+                video_path=video_path,
+                target_groups=target_groups
+            )
+        elif image_paths:
+            sent = await self.sender.send_combined_message(
+                text=message_info["text_content"],
+                image_paths=image_paths,
+                target_groups=target_groups
+            )
+        else:
+            sent = await self.sender.send_text_message(message_info["text_content"], target_groups)
+
+        # 带媒体的消息记入缓存区，供随机搬运使用
+        if sent and (image_paths or video_path):
+            await self.local_cache.add_cache(msg_id, message_info.get("raw"), kind="media")
+
+    async def process_forward_message(self, forward_manager: ForwardManager, message_data: dict, msg_id: int,
+                                      target_groups):
         """处理转发消息 - 直接通过forward_manager转发"""
+        # 等待去重记录加载完成，避免重启后的消息与加载过程竞争
+        await self.local_cache.wait_ready()
+        # 按全部节点内容计算去重键，同一聊天记录的展开结果按转发 id 缓存
+        # 配置了屏蔽关键词时才收集节点文本，未配置时嵌套聊天记录可直接复用缓存的子指纹
+        texts = [] if len(self.keyword_filter) else None
+        key = await self.local_cache.forward_key(message_data, forward_manager.get_forward_msg, texts)
+        # 展开出的节点文本和文件名中含有屏蔽关键词时跳过；全文指纹记入存储，
+        # 再次出现时命中指纹缓存不会展开，直接按重复跳过。
+        # 指纹计算失败时的首尾去重键会与首尾相同的其他聊天记录冲突，不记录
+        hit = self.keyword_filter.match(texts or [])
+        if hit:
+            logger.info("转发消息 %s 命中屏蔽关键词 '%s'，跳过处理", msg_id, hit)
+            if key.startswith("fp:"):
+                await self.dedup_store.check_and_add("forward", key)
+            return
         # 检查是否为重复转发
-        if self.local_cache.is_duplicate_forward(message_data):
-            logger.info(f"[MediaMonitor] 检测到重复转发消息, ID: {msg_id}，跳过处理")
+        if await self.local_cache.is_duplicate_forward(message_data, key):
+            logger.info("检测到重复转发消息, ID: %s，跳过处理", msg_id)
             return
         
-        logger.info(f"[MediaMonitor] 检测到转发消息, ID: {msg_id}")
-        
-        # 缓存转发消息信息（用于去重）
-        await self.local_cache.add_cache(msg_id, message_data)
+        # 同一内容并发到达时（如同时出现在两个监听群），只有第一个任务占用去重键并转发，
+        # 其余任务等待它完成后直接跳过
+        claimed, shared = await self.flight.do(
+            key or f"msg:{msg_id}", lambda: self.local_cache.claim_forward(msg_id, message_data, key)
+        )
+        if shared or not claimed:
+            logger.info("检测到重复转发消息, ID: %s，跳过处理", msg_id)
+            return
+
+        logger.info("检测到转发消息, ID: %s", msg_id)
         
         # 直接通过forward_manager转发到目标群组
-        if self.target_groups:
-            forward_manager = ForwardManager(event)
-            for target_group in self.target_groups:
+        if target_groups:
+            for target_group in target_groups:
                 try:
                     await forward_manager.send_forward_msg_raw(msg_id, int(target_group))
-                    logger.info(f"[MediaMonitor] 转发消息 {msg_id} 到群组 {target_group}")
+                    logger.info("转发消息 %s 到群组 %s", msg_id, target_group)
                     await asyncio.sleep(1)  # 避免发送过快
                 except Exception as e:
-                    logger.error(f"[MediaMonitor] 转发消息失败: {e}")
+                    logger.error("转发消息失败: %s", e)
 
     def is_forward_message(self, message_data: dict) -> bool:
         """检查是否为转发消息"""
@@ -204,6 +379,48 @@ class MediaMonitorPlugin(Star):
                 return True
         return False
 
+    async def dispatch_message(self, message_data: dict, msg_id, group_id_str: str, rules, forward_manager):
+        """实时消息和补漏消息共用的处理入口"""
+        await self.local_cache.wait_ready()
+        # 同一条源消息只处理一次（事件重复推送、补漏与实时消息重叠）
+        key = message_key(group_id_str, msg_id)
+        if await self.dedup_store.check_and_add("message", key):
+            logger.debug("消息 %s 已处理过，跳过", msg_id)
+            return
+        mark = (group_id_str, msg_id, message_data.get("time"))
+
+        # 分离处理逻辑
+        if self.is_forward_message(message_data):
+            # 转发消息：直接通过forward_manager处理，走轻量通道
+            target_groups = rules.targets_for(group_id_str)
+            await self.scheduler.run("light", lambda: self._settle(
+                key, lambda: self.process_forward_message(forward_manager, message_data, msg_id, target_groups), mark
+            ))
+        else:
+            # 普通消息：通过sender处理，被过滤的消息不再下载转发
+            if await self._settle(key, lambda: self.process_ordinary_message(message_data, msg_id, group_id_str, rules)):
+                # 异步下载和转发，带媒体的消息走重通道
+                lane = "heavy" if self.message_cache[msg_id]["media_files"] else "light"
+                self.scheduler.submit(
+                    lane, lambda: self._settle(key, lambda: self.download_and_forward_ordinary_message(msg_id), mark)
+                )
+            else:
+                self.backfiller.observe(*mark)
+
+    async def _settle(self, key: str, fn, mark=None):
+        """执行源消息的一个处理步骤
+
+        失败时释放源消息的占用，补漏时会重新处理；mark 不为空时，成功后推进补漏水位。
+        """
+        try:
+            result = await fn()
+        except Exception:
+            await self.dedup_store.discard("message", key)
+            raise
+        if mark is not None:
+            self.backfiller.observe(*mark)
+        return result
+
     @filter.event_message_type(filter.EventMessageType.ALL)
     @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
     async def on_message(self, event: AstrMessageEvent):
@@ -216,41 +433,137 @@ class MediaMonitorPlugin(Star):
             return
 
         group_id_str = str(group_id)
-        if self.monitored_groups and group_id_str not in self.monitored_groups:
+        # 整条消息的处理过程使用同一份配置，期间发生的重载不影响本条消息
+        rules = self.filters
+        if not rules.is_monitored(group_id_str):
             return
 
         client = event.bot
+        if self._call_action is None:
+            self._call_action = client.api.call_action
+            self._connected.set()
         msg_id = event.message_obj.message_id
         sender_id = str(event.get_sender_id())
         sender_name = event.get_sender_name()
 
-        logger.info(f"[MediaMonitor] 收到消息 - 群: {group_id_str}, 用户: {sender_name}({sender_id}), 消息ID: {msg_id}")
+        new_trace_id()
+        logger.debug("收到消息 - 群: %s, 用户: %s(%s), 消息ID: %s", group_id_str, sender_name, sender_id, msg_id)
 
         try:
             # 获取完整消息详情
             ret = await client.api.call_action("get_msg", message_id=msg_id)
-
-            # 分离处理逻辑
-            if self.is_forward_message(ret):
-                # 转发消息：直接通过forward_manager处理
-                await self.process_forward_message(event, ret, msg_id)
-            else:
-                # 普通消息：通过sender处理
-                await self.process_ordinary_message(ret, msg_id)
-                # 异步下载和转发
-                asyncio.create_task(self.download_and_forward_ordinary_message(msg_id))
+            await self.dispatch_message(ret, msg_id, group_id_str, rules, ForwardManager(event))
 
         except Exception as e:
             try:
                 # 尝试读取异常属性
                 msg_text = getattr(e, "message", str(e))
                 if msg_text == "消息不存在" :
-                    logger.warning(f"[MediaMonitor] 无意义消息 {msg_id}, message='消息不存在', 已忽略")
+                    logger.warning("无意义消息 %s, message='消息不存在', 已忽略", msg_id)
                     return  
             except Exception:
                 pass
 
             # 其他异常继续打印 traceback
             import traceback
-            logger.error(f"[MediaMonitor] 处理消息失败: {e}")
-            logger.error(f"[MediaMonitor] 错误详情: {traceback.format_exc()}")
+            logger.error("处理消息失败: %s", e)
+            logger.error("错误详情: %s", traceback.format_exc())
+
+    @filter.command("搬一桶")
+    @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
+    async def random_pull(self, event: AstrMessageEvent):
+        """从缓存区随机搬一条聊天记录或媒体消息到当前群"""
+        if not isinstance(event, AiocqhttpMessageEvent):
+            return
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("只能在群聊中使用")
+            return
+
+        await self.local_cache.wait_ready()
+        forward_manager = ForwardManager(event)
+        # 原消息可能已在服务器上失效，失效的条目移出缓存后重抽
+        for _ in range(3):
+            msg_id, kind = self.local_cache.pick_random(
+                self.random_weights, exclude=self.recent_picks.get(group_id)
+            )
+            if msg_id is None:
+                yield event.plain_result("缓存区是空的，还没有可以搬的东西")
+                return
+            try:
+                await forward_manager.send_forward_msg_raw(int(msg_id), int(group_id))
+                self.recent_picks.push(group_id, msg_id)
+                logger.info("随机搬运 %s 消息 %s 到群组 %s", kind, msg_id, group_id)
+                return
+            except Exception as e:
+                if not is_message_missing(e):
+                    # 超时等暂时性错误不移出缓存，留待下次再抽
+                    logger.warning("随机搬运消息 %s 失败: %s", msg_id, e)
+                    break
+                logger.warning("随机搬运消息 %s 已失效，移出缓存: %s", msg_id, e)
+                await self.local_cache.remove_cache(msg_id)
+
+        yield event.plain_result("搬运失败，请稍后再试")
+
+    @filter.command("重载配置")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def reload_config(self, event: AstrMessageEvent):
+        """立即重新读取配置文件，回复生效的配置版本和重载耗时"""
+        try:
+            rules = await self.reloader.reload()
+        except Exception as e:
+            logger.error("配置重载失败: %s", e)
+            yield event.plain_result(f"配置重载失败，继续使用版本 {self.filters.version}: {e}")
+            return
+        loaded_at = datetime.datetime.fromtimestamp(
+            rules.loaded_at, datetime.timezone(datetime.timedelta(hours=8))
+        ).strftime("%Y-%m-%d %H:%M:%S")
+        yield event.plain_result(
+            f"配置已重载\n版本: {rules.version}\n加载时间: {loaded_at}\n"
+            f"耗时: {self.reloader.last_reload_ms:.1f} ms\n"
+            f"监听群 {len(rules.monitored_groups)} 个，目标群 {len(rules.target_groups)} 个，"
+            f"黑名单 {len(rules.blacklist_users)} 人，按群覆盖 {len(rules.group_rules)} 个"
+        )
+
+    @filter.command("补漏")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
+    async def manual_backfill(self, event: AstrMessageEvent):
+        """立即从各群水位开始补漏一次"""
+        if not isinstance(event, AiocqhttpMessageEvent):
+            return
+        if self.backfiller.running:
+            yield event.plain_result("补漏正在进行中")
+            return
+        fed = await self._backfill(event.bot.api.call_action)
+        yield event.plain_result(f"补漏完成，送入流水线 {fed} 条消息")
+
+    @filter.command("搬运状态")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def scheduler_status(self, event: AstrMessageEvent):
+        """查看各通道的排队、并发和延迟统计"""
+        yield event.plain_result(
+            f"配置版本 {self.filters.version}\n{self.scheduler.format_stats()}\n{self.lag_probe.summary()}"
+        )
+
+    @filter.command("性能分析")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def profile(self, event: AstrMessageEvent, seconds: int = 10):
+        """采样指定秒数（最长 60 秒），生成火焰图可用的折叠栈报告"""
+        if self.profiler.running:
+            yield event.plain_result("已有采样在进行中")
+            return
+        seconds = min(max(int(seconds), 1), 60)
+        yield event.plain_result(f"开始采样 {seconds} 秒")
+        try:
+            path, stacks = await self.profiler.profile(seconds)
+        except Exception as e:
+            logger.error("采样失败: %s", e)
+            yield event.plain_result(f"采样失败: {e}")
+            return
+        lines = [f"采样完成，报告: {path}", "线程热点:"]
+        lines += [f"  {frame} × {count}" for frame, count in self.profiler.top_frames(stacks, "thread:")]
+        lines.append("协程等待:")
+        lines += [f"  {frame} × {count}" for frame, count in self.profiler.top_frames(stacks, "task:")]
+        lines.append(self.lag_probe.summary())
+        yield event.plain_result("\n".join(lines))
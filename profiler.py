@@ -0,0 +1,199 @@
+# profiler.py
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from .log import get_logger
+
+logger = get_logger("profiler", "Profiler")
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = "data/plugins_data/astrbot_plugin_fuckanka/profiles"
+# 保留最近多少次卡顿记录
+_STALLS = 50
+
+
+@lru_cache(maxsize=8192)
+def _frame_label(filename: str, name: str, lineno: int) -> str:
+    # 折叠栈格式中 ";" 是分隔符、空格分隔计数，标签里都不能出现
+    label = f"{os.path.basename(filename)}:{name}:{lineno}"
+    return label.replace(";", ",").replace(" ", "_")
+
+
+def fold_frame(frame, limit: int = 64) -> list:
+    """从最外层到最内层的栈帧标签，最多取最内层的 limit 层
+
+    沿 f_back 直接读取代码对象和行号，不经过 traceback（它会查 linecache 读源码行），
+    采样线程持有 GIL 的时间尽量短，减少对被测延迟的干扰。
+    """
+    labels = []
+    while frame is not None and len(labels) < limit:
+        code = frame.f_code
+        labels.append(_frame_label(code.co_filename, code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class LoopLagProbe:
+    """事件循环卡顿探测 - 心跳协程定时打点，看门狗线程发现心跳超时后抓取事件循环线程的调用栈
+
+    心跳恢复时补上这次卡顿的实际时长。只在超过阈值时抓栈，平时开销只有一次定时唤醒。
+    """
+
+    def __init__(self, threshold: float = 0.2, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=_STALLS)
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._beat = time.monotonic()
+        self._current = None  # 看门狗正在记录、尚未结束的卡顿
+        self._loop_thread = None
+        self._stop = threading.Event()
+        self._task = None
+
+    def start(self):
+        """在事件循环中调用"""
+        if self.threshold <= 0 or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="fuckanka-lag-watchdog", daemon=True).start()
+        logger.info("事件循环卡顿探测已启动，阈值 %.0f ms", self.threshold * 1000)
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = now - before - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            stall = self._current
+            if stall is not None:
+                # 卡顿结束，记录实际时长（看门狗与心跳并发时 lag 可能偏小，保留较大值）
+                self._current = None
+                stall["duration"] = max(lag, stall["duration"])
+                logger.warning(
+                    "事件循环卡顿 %.0f ms，卡住时的调用栈: %s",
+                    stall["duration"] * 1000, " <- ".join(reversed(stall["stack"][-6:])),
+                )
+
+    def _watchdog(self):
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._beat
+            if stalled < self.threshold + self.interval or self._current is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stall = {"at": time.time(), "duration": stalled, "stack": fold_frame(frame)}
+            del frame
+            self._current = stall
+            self.stall_count += 1
+            self.stalls.append(stall)
+
+    def summary(self, recent: int = 3) -> str:
+        lines = [
+            f"事件循环: 最大延迟 {self.max_lag * 1000:.0f} ms，"
+            f"超过 {self.threshold * 1000:.0f} ms 的卡顿 {self.stall_count} 次"
+        ]
+        for stall in list(self.stalls)[-recent:]:
+            at = time.strftime("%m-%d %H:%M:%S", time.localtime(stall["at"]))
+            where = stall["stack"][-1] if stall["stack"] else "?"
+            lines.append(f"  {at} 卡顿 {stall['duration'] * 1000:.0f} ms @ {where}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """限时采样分析 - 输出折叠栈（flamegraph.pl / speedscope 可直接读取）
+
+    线程采样：后台线程按固定间隔读取 sys._current_frames()，覆盖事件循环线程和 to_thread 的工作线程，
+    反映 CPU 占用和阻塞调用。
+    协程采样：在事件循环中定时读取插件任务的挂起栈，反映各协程把时间花在等待什么上。
+    """
+
+    def __init__(self, output_dir: str = DEFAULT_PROFILE_DIR, interval: float = 0.005,
+                 task_interval: float = 0.05):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.task_interval = task_interval
+        self.running = False
+
+    def _sample_threads(self, duration: float) -> Counter:
+        stacks = Counter()
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                name = names.get(ident, str(ident)).replace(" ", "_").replace(";", ",")
+                stacks[";".join([f"thread:{name}", *fold_frame(frame)])] += 1
+            # 不持有其他线程的栈帧，避免延长局部变量的生命周期
+            del frames
+            time.sleep(self.interval)
+        return stacks
+
+    async def _sample_tasks(self, duration: float) -> Counter:
+        stacks = Counter()
+        current = asyncio.current_task()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for task in asyncio.all_tasks():
+                if task is current or task.done():
+                    continue
+                frames = task.get_stack(limit=32)
+                if not any(f.f_code.co_filename.startswith(PLUGIN_DIR) for f in frames):
+                    continue
+                labels = [_frame_label(f.f_code.co_filename, f.f_code.co_name, f.f_lineno) for f in frames]
+                stacks[";".join([f"task:{task.get_name()}", *labels])] += 1
+            await asyncio.sleep(self.task_interval)
+        return stacks
+
+    async def profile(self, duration: float) -> tuple:
+        """采样 duration 秒，写出报告，返回 (报告路径, 合并后的栈计数)"""
+        if self.running:
+            raise RuntimeError("已有采样在进行中")
+        self.running = True
+        try:
+            threads, tasks = await asyncio.gather(
+                asyncio.to_thread(self._sample_threads, duration), self._sample_tasks(duration)
+            )
+            stacks = threads + tasks
+            path = os.path.join(self.output_dir, time.strftime("profile_%Y%m%d_%H%M%S.folded"))
+            await asyncio.to_thread(self._write, path, stacks)
+            logger.info("采样完成，%s 个不同的调用栈，报告已写入 %s", len(stacks), path)
+            return path, stacks
+        finally:
+            self.running = False
+
+    def _write(self, path: str, stacks: Counter):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    @staticmethod
+    def top_frames(stacks: Counter, prefix: str, n: int = 5) -> list:
+        """按最内层栈帧汇总采样数，返回 [(栈帧, 次数)]"""
+        leaves = Counter()
+        for stack, count in stacks.items():
+            if stack.startswith(prefix):
+                leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
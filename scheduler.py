@@ -0,0 +1,132 @@
+# scheduler.py
+import asyncio
+import contextvars
+import time
+from collections import deque
+from .log import get_logger
+
+logger = get_logger("scheduler", "Scheduler")
+
+# 每条通道保留最近多少次任务的耗时用于统计
+_SAMPLES = 256
+
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Lane:
+    """一条任务通道：独立的队列、并发上限和权重"""
+
+    def __init__(self, name: str, weight: float, concurrency: int):
+        self.name = name
+        self.weight = max(weight, 0.01)
+        self.concurrency = max(1, concurrency)
+        self.queue = deque()
+        self.running = 0
+        self.vtime = 0.0
+        self.done = 0
+        self.failed = 0
+        self.waits = deque(maxlen=_SAMPLES)  # 排队耗时（秒）
+        self.runs = deque(maxlen=_SAMPLES)   # 执行耗时（秒）
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.queue),
+            "running": self.running,
+            "done": self.done,
+            "failed": self.failed,
+            "wait_p50": _percentile(self.waits, 0.5),
+            "wait_p95": _percentile(self.waits, 0.95),
+            "run_p50": _percentile(self.runs, 0.5),
+            "run_p95": _percentile(self.runs, 0.95),
+        }
+
+
+class LaneScheduler:
+    """多通道调度器 - 加权公平分配全局并发，各通道另有自己的并发上限
+
+    轻量任务（服务端转发、纯文本）和重任务（下载上传媒体）分开排队，
+    重任务占满自己的并发额度后不会再挤占轻量通道。
+    全局并发紧张时按虚拟时间选择通道：每派发一个任务，通道的虚拟时间增加 1/权重，
+    总是派发虚拟时间最小的通道，长期看各通道获得的执行次数与权重成正比。
+    """
+
+    def __init__(self, lanes: dict, max_concurrency: int = 4):
+        """lanes: 通道名 -> (权重, 并发上限)"""
+        self.lanes = {name: Lane(name, weight, concurrency) for name, (weight, concurrency) in lanes.items()}
+        self.max_concurrency = max(1, max_concurrency)
+        self._running = 0
+        self._vtime = 0.0
+
+    def submit(self, lane: str, fn) -> asyncio.Future:
+        """提交 fn()（协程函数）到指定通道，返回结果 Future；不关心结果时可以不等待"""
+        target = self.lanes[lane]
+        future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已读取，错误已由调度器记录日志
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if not target.queue and target.running == 0:
+            # 空闲通道重新活跃时从当前虚拟时间起算，不累积空闲期间的份额
+            target.vtime = max(target.vtime, self._vtime)
+        # 保留提交时的上下文（追踪 ID），任务执行时沿用
+        target.queue.append((fn, future, time.perf_counter(), contextvars.copy_context()))
+        self._dispatch()
+        return future
+
+    async def run(self, lane: str, fn):
+        """提交并等待结果"""
+        return await self.submit(lane, fn)
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency:
+            ready = [l for l in self.lanes.values() if l.queue and l.running < l.concurrency]
+            if not ready:
+                return
+            lane = min(ready, key=lambda l: l.vtime)
+            fn, future, enqueued, ctx = lane.queue.popleft()
+            lane.vtime += 1 / lane.weight
+            self._vtime = lane.vtime - 1 / lane.weight
+            lane.running += 1
+            self._running += 1
+            lane.waits.append(time.perf_counter() - enqueued)
+            ctx.run(asyncio.create_task, self._run(lane, fn, future))
+
+    async def _run(self, lane: Lane, fn, future):
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            lane.failed += 1
+            logger.error("%s 通道任务失败: %s", lane.name, e)
+            if not future.done():
+                future.set_exception(e)
+        else:
+            lane.done += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            lane.runs.append(time.perf_counter() - start)
+            lane.running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def format_stats(self) -> str:
+        lines = [f"并发 {self._running}/{self.max_concurrency}"]
+        for name, lane in self.lanes.items():
+            st = lane.stats()
+            lines.append(
+                f"{name}（权重 {lane.weight:g}，并发 {st['running']}/{lane.concurrency}）: "
+                f"排队 {st['queued']}，完成 {st['done']}，失败 {st['failed']}，"
+                f"等待 p50/p95 {st['wait_p50'] * 1000:.0f}/{st['wait_p95'] * 1000:.0f} ms，"
+                f"执行 p50/p95 {st['run_p50'] * 1000:.0f}/{st['run_p95'] * 1000:.0f} ms"
+            )
+        return "\n".join(lines)
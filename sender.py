@@ -1,53 +1,77 @@
 # sender.py
 from astrbot.api.event import MessageChain
 from astrbot.api.message_components import Video
-from astrbot.api import logger
 import asyncio
 import hashlib
+import logging
 import os
 import json
+import time
 import aiofiles
+from .dedup_store import MemoryDedupStore
+from .log import get_logger
+from .snapshot import load_digests
+
+logger = get_logger("sender", "MessageSender")
 
 class MessageSender:
-    """消息发送器 - 支持文本、图片、视频，并记录已发送文件的 MD5 到磁盘"""
+    """消息发送器 - 支持文本、图片、视频，并通过去重存储记录已发送文件的 MD5"""
 
-    def __init__(self, context, target_groups, temp_dir: str = None):
+    def __init__(self, context, target_groups, temp_dir: str = None, md5_lookup=None, store=None,
+                 normalizer=None):
         self.context = context
+        # 可选：上传前的图片规范化（缩放/转码）
+        self.normalizer = normalizer
+        # 去重判断走 store：内存中只有布隆过滤器，精确记录在磁盘上
+        self.store = store or MemoryDedupStore()
+        # 可选：根据文件路径取回下载时已算好的 MD5，避免重复读文件
+        self.md5_lookup = md5_lookup
         self.target_groups = target_groups
         self.temp_dir = temp_dir or "data/plugins_data/astrbot_plugin_fuckanka/temp/shit"
         os.makedirs(self.temp_dir, exist_ok=True)
-        self.md5_file = os.path.join(self.temp_dir, "sent_md5.json")
-        self.sent_md5 = set()
-        # 异步加载 MD5
+        # 旧版本的 MD5 快照，启动时导入 store 后改名，不再写入
+        self.md5_file = os.path.join(self.temp_dir, "sent_md5.bin")
+        self.legacy_md5_file = os.path.join(self.temp_dir, "sent_md5.json")
+        # 异步加载去重状态，加载完成前的去重检查会等待 ready
+        self.ready = asyncio.Event()
         asyncio.create_task(self._async_init())
-        logger.info(f"[MessageSender] 初始化完成，目标群组: {target_groups}")
+        logger.info("初始化完成，目标群组: %s", target_groups)
 
     async def _async_init(self):
         """异步初始化"""
-        self.sent_md5 = await self._load_md5()
+        start = time.perf_counter()
+        try:
+            await self.store.warm_up()
+            await self._migrate_md5()
+        finally:
+            self.ready.set()
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info("去重状态已就绪，耗时 %.1f ms", elapsed)
+
+    async def wait_ready(self):
+        """等待去重状态加载完成"""
+        await self.ready.wait()
 
-    async def _load_md5(self):
-        """异步从文件加载已发送的 MD5"""
-        if await asyncio.to_thread(os.path.exists, self.md5_file):
+    async def _migrate_md5(self):
+        """把旧版 MD5 快照导入 store；store 可持久化时导入后改名，避免重复导入"""
+        for path in (self.md5_file, self.legacy_md5_file):
             try:
-                async with aiofiles.open(self.md5_file, "r", encoding="utf-8") as f:
-                    content = await f.read()
-                    data = json.loads(content) if content.strip() else []
-                    logger.info(f"[MessageSender] 已加载 {len(data)} 条已发送 MD5")
-                    return set(data)
+                if not await asyncio.to_thread(os.path.exists, path):
+                    continue
+                if path == self.md5_file:
+                    data = await asyncio.to_thread(load_digests, path)
+                else:
+                    async with aiofiles.open(path, "r", encoding="utf-8") as f:
+                        content = await f.read()
+                    data = set(json.loads(content)) if content.strip() else set()
+                # 旧快照不区分图片和视频，两个命名空间都导入
+                for namespace in ("image", "video"):
+                    await asyncio.to_thread(self.store.add_many, namespace, data)
+                if self.store.persistent:
+                    await asyncio.to_thread(os.replace, path, f"{path}.migrated")
+                logger.info("已从 %s 导入 %s 条 MD5", path, len(data))
             except Exception as e:
-                logger.error(f"[MessageSender] 加载 MD5 文件失败: {e}")
-        return set()
-
-    async def _save_md5(self):
-        """异步将已发送的 MD5 保存到文件"""
-        try:
-            data = json.dumps(list(self.sent_md5), ensure_ascii=False, indent=2)
-            async with aiofiles.open(self.md5_file, "w", encoding="utf-8") as f:
-                await f.write(data)
-            logger.info(f"[MessageSender] 已保存 {len(self.sent_md5)} 条 MD5")
-        except Exception as e:
-            logger.error(f"[MessageSender] 保存 MD5 文件失败: {e}")
+                logger.error("导入 MD5 文件 %s 失败: %s", path, e)
 
     def _get_session_id(self, group_id: int) -> str:
         return f"aiocqhttp:GroupMessage:{group_id}"
@@ -56,14 +80,18 @@ class MessageSender:
         try:
             session_id = self._get_session_id(group_id)
             await self.context.send_message(session_id, message_chain)
-            logger.info(f"[MessageSender] 消息成功发送到群组 {group_id}")
+            logger.debug("消息成功发送到群组 %s", group_id)
             return True
         except Exception as e:
-            logger.error(f"[MessageSender] 发送消息到群组 {group_id} 失败: {e}")
+            logger.error("发送消息到群组 %s 失败: %s", group_id, e)
             return False
 
     async def _calc_md5(self, file_path: str) -> str:
         """异步计算文件 MD5"""
+        if self.md5_lookup:
+            md5 = self.md5_lookup(file_path)
+            if md5:
+                return md5
         if not await asyncio.to_thread(os.path.exists, file_path):
             return ""
         
@@ -77,71 +105,91 @@ class MessageSender:
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
 
-    async def _is_duplicate(self, file_path: str) -> bool:
-        """异步检查文件是否重复"""
-        md5 = await self._calc_md5(file_path)
+    async def _is_duplicate(self, file_path: str, md5: str = None, kind: str = "image") -> bool:
+        """异步检查文件是否重复，md5 已知时可直接传入；kind 决定使用哪个去重窗口"""
+        await self.wait_ready()
+        if md5 is None:
+            md5 = await self._calc_md5(file_path)
         if not md5:
             return False
-        if md5 in self.sent_md5:
-            logger.info(f"[MessageSender] 检测到重复文件 (md5={md5})，跳过发送: {file_path}")
+        if await self.store.check_and_add(kind, md5):
+            logger.sampled(logging.INFO, "duplicate_file", "检测到重复文件 (md5=%s)，跳过发送: %s", md5, file_path)
             return True
-        self.sent_md5.add(md5)
-        await self._save_md5()  # 异步保存
         return False
 
-    async def send_text_message(self, text: str):
+    def _targets(self, target_groups):
+        """本次发送的目标群，未指定时使用初始化时的目标群"""
+        return self.target_groups if target_groups is None else target_groups
+
+    async def send_text_message(self, text: str, target_groups=None):
         if not text:
             return False
+        await self.wait_ready()
+        key = hashlib.md5(text.strip().encode("utf-8")).hexdigest()
+        if await self.store.check_and_add("text", key):
+            logger.sampled(logging.INFO, "duplicate_text", "检测到重复文本，跳过发送")
+            return True
         success = True
-        for gid in self.target_groups:
+        for gid in self._targets(target_groups):
             chain = MessageChain().message(text)
             if not await self._send_message_chain(int(gid), chain):
                 success = False
             await asyncio.sleep(0.3)
         return success
 
-    async def send_image_message(self, image_paths: list, text: str = None):
+    async def send_image_message(self, image_paths: list, text: str = None, target_groups=None):
         if not image_paths:
             return False
+        # 去重和规范化只做一次，结果发往所有目标群
+        upload_paths = []
+        for img_path in image_paths:
+            md5 = await self._calc_md5(img_path)
+            if await self._is_duplicate(img_path, md5):  # 异步检查
+                continue
+            if self.normalizer:
+                img_path = await self.normalizer.normalize(img_path, md5)
+            upload_paths.append(img_path)
+        if not text and not upload_paths:
+            return True
+
         success = True
-        for gid in self.target_groups:
+        for gid in self._targets(target_groups):
             chain = MessageChain()
             if text:
                 chain = chain.message(text)
-            for img_path in image_paths:
-                if await self._is_duplicate(img_path):  # 异步检查
-                    continue
+            for img_path in upload_paths:
                 chain = chain.file_image(img_path)
             if not await self._send_message_chain(int(gid), chain):
                 success = False
             await asyncio.sleep(0.3)
         return success
 
-    async def send_video_message(self, video_path: str):
+    async def send_video_message(self, video_path: str, target_groups=None):
         if not video_path:
             return False
-        if await self._is_duplicate(video_path):  # 异步检查
+        if await self._is_duplicate(video_path, kind="video"):  # 异步检查
             return True
         success = True
-        for gid in self.target_groups:
+        for gid in self._targets(target_groups):
             try:
                 session_id = self._get_session_id(int(gid))
                 video = Video.fromFileSystem(path=video_path)
                 chain = MessageChain([video])
                 await self.context.send_message(session_id, chain)
-                logger.info(f"[MessageSender] 视频已发送到群 {gid}")
+                logger.info("视频已发送到群 %s", gid)
                 await asyncio.sleep(1)
             except Exception as e:
-                logger.error(f"[MessageSender] 视频消息发送失败: {e}")
+                logger.error("视频消息发送失败: %s", e)
                 success = False
         return success
 
-    async def send_combined_message(self, text: str = None, image_paths: list = None, video_path: str = None):
+    async def send_combined_message(self, text: str = None, image_paths: list = None, video_path: str = None,
+                                    target_groups=None):
         success = True
         if text or image_paths:
-            if not await self.send_image_message(image_paths or [], text=text):
+            if not await self.send_image_message(image_paths or [], text=text, target_groups=target_groups):
                 success = False
         if video_path:
-            if not await self.send_video_message(video_path):
+            if not await self.send_video_message(video_path, target_groups=target_groups):
                 success = False
         return success
@@ -0,0 +1,40 @@
+# singleflight.py
+import asyncio
+
+
+class SingleFlight:
+    """相同 key 的并发调用只执行一次，其余调用等待并共享第一次调用的结果"""
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        """执行 fn()（协程函数），返回 (结果, 是否共享了其他调用的结果)
+
+        第一次调用抛出的异常会同样抛给所有等待者；结束后 key 立即释放，
+        之后的新调用会重新执行。
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已读取，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
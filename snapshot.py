@@ -0,0 +1,116 @@
+# snapshot.py
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from .log import get_logger
+
+logger = get_logger("snapshot", "Snapshot")
+
+# 旧版 MD5 快照中每条摘要固定 16 字节，按定长记录连续存放
+DIGEST_SIZE = 16
+
+# 每个快照路径的 [写锁, 已分配的序号, 已落盘的序号]
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _ticket(path: str) -> tuple:
+    """分配写入序号，序号按调用顺序递增"""
+    with _writers_lock:
+        state = _writers.setdefault(path, [threading.Lock(), 0, 0])
+        state[1] += 1
+        return state, state[1]
+
+
+def _atomic_write(path: str, data: bytes, ticket: tuple = None):
+    """先写临时文件再替换，避免写到一半进程退出导致快照损坏
+
+    临时文件名唯一，同一路径的写入串行执行；线程池中的写入可能乱序完成，
+    序号较旧的数据在更新的数据落盘后直接丢弃。
+    """
+    state, seq = ticket or _ticket(path)
+    with state[0]:
+        if seq < state[2]:
+            return
+        directory, name = os.path.split(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        state[2] = seq
+
+
+def _report(path: str):
+    def done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("写入快照 %s 失败: %s", path, future.exception())
+    return done
+
+
+def dump_in_background(path: str, data: bytes):
+    """在线程中原子写入已编码的快照，返回 Future，失败时记录日志
+
+    序号在调用时分配，之后的同步写入总会覆盖这次写入。没有运行中的事件循环时直接同步写入。
+    """
+    ticket = _ticket(path)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _atomic_write(path, data, ticket)
+        return None
+    future = loop.run_in_executor(None, _atomic_write, path, data, ticket)
+    future.add_done_callback(_report(path))
+    return future
+
+
+def dump_bytes(path: str, data: bytes):
+    """原子写入二进制快照"""
+    _atomic_write(path, data)
+
+
+def load_bytes(path: str) -> bytes:
+    """读取二进制快照，文件不存在时返回空字节串"""
+    if not os.path.exists(path):
+        return b""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def encode_json(obj) -> bytes:
+    """紧凑格式（无缩进、无多余空格）的 JSON 编码"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dump_json(path: str, obj):
+    """以紧凑格式写入 JSON 快照"""
+    _atomic_write(path, encode_json(obj))
+
+
+def load_json(path: str, default=None):
+    """读取 JSON 快照，文件不存在或为空时返回 default"""
+    if not os.path.exists(path):
+        return default
+    with open(path, "rb") as f:
+        content = f.read()
+    if not content.strip():
+        return default
+    return json.loads(content)
+
+
+def load_digests(path: str) -> set:
+    """读取二进制 MD5 快照，返回十六进制字符串集合"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % DIGEST_SIZE
+    return {data[i:i + DIGEST_SIZE].hex() for i in range(0, usable, DIGEST_SIZE)}
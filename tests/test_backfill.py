@@ -0,0 +1,136 @@
+# tests/test_backfill.py
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 插件依赖 AstrBot 提供的 logger，测试时用标准库 logger 代替
+if "astrbot.api" not in sys.modules:
+    astrbot = types.ModuleType("astrbot")
+    api = types.ModuleType("astrbot.api")
+    api.logger = logging.getLogger("astrbot")
+    astrbot.api = api
+    sys.modules.setdefault("astrbot", astrbot)
+    sys.modules["astrbot.api"] = api
+
+# 插件目录没有 __init__.py，由 AstrBot 作为包加载；这里以同样的方式挂成一个包
+if "fuckanka" not in sys.modules:
+    package = types.ModuleType("fuckanka")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["fuckanka"] = package
+
+backfill = importlib.import_module("fuckanka.backfill")
+dedup_store = importlib.import_module("fuckanka.dedup_store")
+
+GROUP = "123"
+
+
+def _message(message_id, ts):
+    return {"message_id": message_id, "message_seq": message_id, "time": ts, "message": []}
+
+
+class FakeHistory:
+    """按 message_seq 分页的 get_group_msg_history：返回锚点（含）之前的 count 条，按时间升序"""
+
+    def __init__(self, messages):
+        self.messages = sorted(messages, key=lambda m: m["message_seq"])
+        self.calls = []
+
+    async def __call__(self, action, group_id, count, message_seq=None):
+        assert action == "get_group_msg_history"
+        self.calls.append(message_seq)
+        older = [m for m in self.messages if message_seq is None or m["message_seq"] <= message_seq]
+        return {"messages": older[-count:]}
+
+
+def _backfiller(tmp_path, mark, **kwargs):
+    state_path = os.path.join(tmp_path, "backfill.json")
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump({GROUP: mark}, f)
+    filler = backfill.Backfiller(state_path, dedup_store.MemoryDedupStore(), rate=0, **kwargs)
+    filler.load()
+    return filler
+
+
+def _pipeline(filler, store, handled):
+    """模拟 dispatch_message：按源消息去重，处理后推进水位"""
+    async def handler(group_id, message):
+        if await store.check_and_add("message", backfill.message_key(group_id, message["message_id"])):
+            return
+        filler.observe(group_id, message["message_id"], message["time"])
+        handled.append(message["message_id"])
+    return handler
+
+
+def test_same_second_messages_at_the_mark(tmp_path):
+    filler = _backfiller(tmp_path, {"time": 100, "ids": ["5"]})
+    history = FakeHistory([_message(4, 99), _message(5, 100), _message(6, 100), _message(7, 101)])
+
+    messages = asyncio.run(filler.fetch_new(history, GROUP))
+
+    # 与水位同一秒、但未处理过的 6 需要补回，已处理的 5 和更早的 4 不再取回
+    assert [m["message_id"] for m in messages] == [6, 7]
+
+
+def test_already_seen_messages_are_skipped(tmp_path):
+    filler = _backfiller(tmp_path, {"time": 100, "ids": []})
+    history = FakeHistory([_message(i, 100 + i) for i in range(1, 6)])
+    handled = []
+
+    async def run():
+        # 实时流程已经处理过 3 和 5
+        for message_id in (3, 5):
+            await filler.store.check_and_add("message", backfill.message_key(GROUP, message_id))
+        return await filler.run(history, [GROUP], _pipeline(filler, filler.store, handled))
+
+    fed = asyncio.run(run())
+
+    assert handled == [1, 2, 4]
+    assert fed == 3
+
+
+def test_max_messages_caps_the_newest(tmp_path, caplog):
+    filler = _backfiller(tmp_path, {"time": 0, "ids": []}, page_size=3, max_messages=5)
+    history = FakeHistory([_message(i, 100 + i) for i in range(1, 21)])
+
+    with caplog.at_level(logging.WARNING):
+        messages = asyncio.run(filler.fetch_new(history, GROUP))
+
+    # 只保留最新的 max_messages 条，并在收集够之后停止翻页；截断时记录警告
+    assert [m["message_id"] for m in messages] == [16, 17, 18, 19, 20]
+    assert len(history.calls) <= 3
+    assert "达到 5 条上限" in caplog.text
+
+
+def test_no_truncation_warning_within_the_cap(tmp_path, caplog):
+    filler = _backfiller(tmp_path, {"time": 100, "ids": []}, page_size=3, max_messages=5)
+    history = FakeHistory([_message(i, 100 + i) for i in range(1, 4)])
+
+    with caplog.at_level(logging.WARNING):
+        messages = asyncio.run(filler.fetch_new(history, GROUP))
+
+    assert [m["message_id"] for m in messages] == [1, 2, 3]
+    assert "上限" not in caplog.text
+
+
+def test_second_run_feeds_nothing(tmp_path):
+    filler = _backfiller(tmp_path, {"time": 100, "ids": []})
+    history = FakeHistory([_message(i, 100 + i) for i in range(1, 6)])
+    handled = []
+    handler = _pipeline(filler, filler.store, handled)
+
+    async def run():
+        first = await filler.run(history, [GROUP], handler)
+        second = await filler.run(history, [GROUP], handler)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == 5
+    assert second == 0
+    assert handled == [1, 2, 3, 4, 5]